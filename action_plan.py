@@ -0,0 +1,115 @@
+"""
+Batched multi-step plans with local postconditions.
+
+In batched mode Gemini may answer with an ordered list of actions instead of a
+single one. Every step that is followed by another step carries an "expect"
+postcondition. The orchestrator executes the steps in order and, between steps,
+checks that postcondition against a freshly captured page_source (no screenshot,
+no model call). Gemini is consulted again only when a postcondition fails or the
+plan is used up.
+
+Postconditions:
+
+    {"by": "ID", "value": "android:id/switch_widget", "checked": true}  element present and (un)checked
+    {"by": "XPATH", "value": "//*[@text='OK']"}                          element present
+    {"by": "XPATH", "value": "//*[@text='OK']", "present": false}        element absent
+    {"text": "Saved"}                                                    text or content-desc on screen
+    {"text": "Loading", "present": false}                                text gone from the screen
+"""
+from element_index import MISSING, UNSUPPORTED, ElementIndex
+from ui_compaction import iter_descendants
+
+PLAN_MODES = ("single", "batched")
+DEFAULT_MAX_PLAN_STEPS = 8
+TERMINAL_ACTIONS = ("GOAL_ACHIEVED", "GOAL_IMPOSSIBLE", "ERROR")
+
+
+def plan_steps(response, max_steps=DEFAULT_MAX_PLAN_STEPS):
+    """
+    Normalizes a parsed Gemini response (one action, {"plan": [...]} or a bare list) to a list of steps.
+    A plan is cut after the first non-terminal step without a postcondition, since the steps after
+    it could not be checked, and a terminal action is only kept as the plan's last step.
+    """
+    if isinstance(response, list):
+        raw_steps = response
+    elif isinstance(response, dict) and isinstance(response.get("plan"), list):
+        raw_steps = response["plan"]
+    else:
+        return [response]
+
+    steps = []
+    for step in raw_steps[:max_steps]:
+        if not isinstance(step, dict):
+            break
+        steps.append(step)
+        if step.get("action") in TERMINAL_ACTIONS:
+            break
+        if not step.get("expect"):
+            break
+    if not steps:
+        return [{"action": "ERROR", "message": "EMPTY_PLAN", "raw_response": str(response)}]
+    # Declaring the goal achieved at the end of a plan is only trustworthy if every earlier step was verified
+    if len(steps) > 1 and steps[-1].get("action") == "GOAL_ACHIEVED" and not all(s.get("expect") for s in steps[:-1]):
+        steps.pop()
+    return steps
+
+
+def _checked_state(node):
+    """True/False for a checkable node or a row whose checkable descendants all agree, else None."""
+    if node.get("checkable") == "true":
+        return node.flag("checked")
+    states = {d.flag("checked") for d in iter_descendants(node) if d.get("checkable") == "true"}
+    return states.pop() if len(states) == 1 else None
+
+
+def _expected_flag(value):
+    """A postcondition flag as a bool; free-form replies may spell it "true"/"false". None if neither."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+
+def check_postcondition(ui_tree, expect):
+    """
+    Checks one postcondition against a UI tree (XML, UiTree or ElementIndex).
+    Returns (ok, reason); ok is None when the postcondition can't be evaluated locally.
+    """
+    index = ui_tree if isinstance(ui_tree, ElementIndex) else ElementIndex(ui_tree)
+    want_present = _expected_flag(expect.get("present", True))
+    if want_present is None:
+        return None, f"can't read present={expect.get('present')!r} in {expect}"
+
+    if expect.get("text") is not None and not expect.get("by"):
+        text = str(expect["text"])
+        present = any(text in node.text or text in node.content_desc
+                      for node in index.tree.nodes if node.is_visible(index.tree.screen))
+        if present == want_present:
+            return True, ""
+        return False, f"text '{text}' is {'not ' if want_present else 'still '}on screen"
+
+    if not expect.get("by"):
+        return None, f"unrecognized postcondition {expect}"
+    resolution = index.resolve(expect["by"], expect.get("value"))
+    locator = f"By={expect['by']}, Value='{expect.get('value')}'"
+    if resolution.status == UNSUPPORTED:
+        return None, f"{locator} can't be checked locally"
+    if resolution.status == MISSING:
+        if not want_present:
+            return True, ""
+        return False, f"no element matches {locator}"
+    if not want_present:
+        return False, f"{locator} is still on screen"
+
+    if "checked" in expect:
+        want_checked = _expected_flag(expect["checked"])
+        if want_checked is None:
+            return None, f"can't read checked={expect['checked']!r} for {locator}"
+        states = {_checked_state(node) for node in resolution.nodes}
+        if states == {want_checked}:
+            return True, ""
+        if None in states:
+            return None, f"{locator} has no checked state"
+        return False, f"{locator} is {'checked' if not want_checked else 'unchecked'}"
+    return True, ""
@@ -0,0 +1,197 @@
+"""
+Offline benchmark of the whole Perceive-Plan-Act loop.
+
+Drives run_goal() from the main script against a FakeDriver (recorded page_source
+dumps, simulated Appium latency) and a FakeGenerativeModel (canned responses),
+so changes to the loop can be measured on a plain Linux box with no device and
+no network. Reports wall time split into perception, planning, execution and
+settle, plus request payload sizes, turns and model calls per goal, and how
+much perception latency concurrent and prefetched captures saved per turn, and
+the planner's time to action and parse-failure rate per response mode.
+
+Usage:
+    python benchmarks/bench_agent_loop.py [scenario.json ...] [--plan-mode single|batched|all]
+                                          [--latency-scale 1.0] [--screenshot-mode always|auto|never]
+                                          [--perception concurrent|sequential|all]
+                                          [--planner blocking|streaming|structured|all]
+
+With no paths, runs every scenario in benchmarks/scenarios/. Each scenario is run
+once per plan mode it has scripted responses for (--plan-mode all, the default).
+"""
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_device import FakeDriver
+from fake_gemini import FakeGenerativeModel
+
+SCENARIOS_DIR = os.path.join(BENCH_DIR, "scenarios")
+SCRIPT_NAMES = ("second.py", "second[1].py")
+PHASES = ("perception", "planning", "execution", "settle")
+# Planner response modes: (stream the reply, ask for structured JSON output)
+PLANNER_MODES = {"blocking": (False, False), "streaming": (True, False), "structured": (True, True)}
+
+
+def load_agent_script():
+    """Imports the main script as a module (its file name isn't importable directly)."""
+    for name in SCRIPT_NAMES:
+        path = os.path.join(ROOT_DIR, name)
+        if os.path.exists(path):
+            spec = importlib.util.spec_from_file_location("agent_script", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+    raise FileNotFoundError(f"None of {SCRIPT_NAMES} found in {ROOT_DIR}")
+
+
+class PhaseClock:
+    """
+    Accumulates wall time per phase; time inside a nested phase counts toward the outermost one.
+    Only the loop's own thread is timed: background captures overlap with it and cost no wall time.
+    """
+
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self._active = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self._active is not None or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        self._active = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+            self._active = None
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return timed
+
+
+def run_scenario(script, scenario, plan_mode, latency_scale, perception="concurrent", planner="streaming",
+                 verbose=False):
+    clock = PhaseClock()
+    driver = FakeDriver(scenario, base_dir=BENCH_DIR, latency_scale=latency_scale, clock=clock)
+    model = FakeGenerativeModel(scenario["responses"][plan_mode], latency_scale=latency_scale)
+    streaming, structured_output = PLANNER_MODES[planner]
+    agent = script.GeminiAgent(plan_mode=plan_mode, model=model, streaming=streaming, structured_output=structured_output)
+    model.system_instruction = agent.system_instruction
+    executor = script.AppiumExecutor(driver)
+    capture = script.ScreenCapture(driver, **dict(script.PERCEPTION_SETTINGS, concurrent=perception == "concurrent"))
+
+    agent.analyze_and_plan = clock.wrap("planning", agent.analyze_and_plan)
+    executor._perform_action = clock.wrap("execution", executor._perform_action)
+    executor.settle_waiter.wait = clock.wrap("settle", executor.settle_waiter.wait)
+    capture.capture = clock.wrap("perception", capture.capture)
+    capture.screenshot = clock.wrap("perception", capture.screenshot)
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if verbose else log):
+        result = script.run_goal(driver, scenario["goal"], gemini_agent=agent, appium_executor=executor,
+                                 max_turns=scenario.get("max_turns", 20), screen_capture=capture)
+    wall = time.perf_counter() - start
+    capture.close()
+
+    return {
+        "scenario": scenario.get("name", "?"),
+        "plan_mode": plan_mode,
+        "perception": perception,
+        "planner": planner,
+        "status": result["status"],
+        "turns": result["turns"],
+        "model_calls": result["model_calls"],
+        "actions": result.get("actions", 0),
+        "wall": wall,
+        "phases": clock.totals,
+        "time_to_action": sum(agent.planner_stats.time_to_action) / max(1, len(agent.planner_stats.time_to_action)),
+        "parse_failures": agent.planner_stats.methods.get("repaired", 0) + agent.planner_stats.unparseable,
+        "perception_saved_per_turn": sum(p.saved_seconds for p in capture.samples) / max(1, len(capture.samples)),
+        "input_bytes": sum(r["input_bytes"] for r in model.requests),
+        "input_tokens": sum(r["input_tokens"] for r in model.requests),
+        "images": sum(r["images"] for r in model.requests),
+        "driver_calls": dict(driver.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="scenario JSON files or directories of them")
+    parser.add_argument("--plan-mode", default="all", help="single, batched or all (every mode the scenario scripts)")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiplier for simulated Appium and model latency (0 for raw loop overhead)")
+    parser.add_argument("--screenshot-mode", choices=("always", "auto", "never"), help="override SCREENSHOT_MODE")
+    parser.add_argument("--perception", choices=("concurrent", "sequential", "all"), default="concurrent",
+                        help="capture page_source and screenshots concurrently, back to back, or both for comparison")
+    parser.add_argument("--planner", choices=tuple(PLANNER_MODES) + ("all",), default="streaming",
+                        help="wait for the whole reply, stream it, or stream structured JSON output")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the agent's own log output")
+    args = parser.parse_args()
+
+    scenario_paths = []
+    for path in args.paths or [SCENARIOS_DIR]:
+        if os.path.isdir(path):
+            scenario_paths.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            scenario_paths.append(path)
+    if not scenario_paths:
+        print("No scenarios found.")
+        return
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        script = load_agent_script()
+    # Benchmarks must not read or grow the persistent plan cache, trajectories or settle logs
+    script.PLAN_CACHE_ENABLED = False
+    script.TRAJECTORY_DIR = None
+    script.SETTLE_LOG_PATH = None
+    if args.screenshot_mode:
+        script.SCREENSHOT_MODE = args.screenshot_mode
+
+    results = []
+    for path in scenario_paths:
+        with open(path, encoding="utf-8") as f:
+            scenario = json.load(f)
+        modes = list(scenario["responses"]) if args.plan_mode == "all" else [args.plan_mode]
+        perceptions = ("sequential", "concurrent") if args.perception == "all" else (args.perception,)
+        planners = tuple(PLANNER_MODES) if args.planner == "all" else (args.planner,)
+        for plan_mode in modes:
+            for perception in perceptions:
+                for planner in planners:
+                    results.append(run_scenario(script, scenario, plan_mode, args.latency_scale, perception, planner,
+                                                args.verbose))
+
+    print(f"{'scenario':30} {'mode':8} {'capture':10} {'planner':10} {'status':16} {'turns':>5} {'calls':>5} {'acts':>4} {'wall s':>7} "
+          + " ".join(f"{phase[:7]:>7}" for phase in PHASES) + f" {'other':>6} {'in KB':>7} {'in tok':>7} {'imgs':>4} {'saved ms/turn':>13} {'tta s':>6} {'bad':>3}")
+    for r in results:
+        other = r["wall"] - sum(r["phases"].values())
+        print(f"{r['scenario'][:30]:30} {r['plan_mode']:8} {r['perception']:10} {r['planner']:10} {r['status'][:16]:16} {r['turns']:5} {r['model_calls']:5} "
+              f"{r['actions']:4} {r['wall']:7.2f} " + " ".join(f"{r['phases'][phase]:7.2f}" for phase in PHASES)
+              + f" {other:6.2f} {r['input_bytes'] / 1024:7.1f} {r['input_tokens']:7} {r['images']:4}"
+              + f" {r['perception_saved_per_turn'] * 1000:13.0f} {r['time_to_action']:6.2f} {r['parse_failures']:3}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
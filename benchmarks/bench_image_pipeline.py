@@ -0,0 +1,92 @@
+"""
+Benchmarks the screenshot pipeline on captured screenshots.
+
+Usage:
+    python benchmarks/bench_image_pipeline.py [shot.png | shot_dir ...]
+
+With no paths, runs over every *.png file in benchmarks/screenshots/. If a
+page_source dump with the same name (shot.xml next to shot.png) exists, it is
+used for system-bar cropping. Frames are processed in name order, so a
+sequence of captures from one run also exercises the "unchanged" check.
+
+The committed set is one pass through the ApiDemos Preference scenario, drawn
+by fake_device.FakeDriver from the recorded dumps (flat colour boxes, so it
+compresses better than a real device screenshot); add real captures next to it
+for representative sizes.
+"""
+import argparse
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_pipeline import ScreenshotPipeline
+from ui_compaction import UiTree
+
+SCREENSHOTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "screenshots")
+
+# Pipeline settings compared by the benchmark; the first row is the pre-pipeline baseline
+CONFIGURATIONS = [
+    ("png full-res", dict(max_dimension=None, image_format="PNG", crop_system_bars=False, skip_unchanged=False)),
+    ("png 1024", dict(max_dimension=1024, image_format="PNG")),
+    ("jpeg 1024 q70", dict(max_dimension=1024, image_format="JPEG", quality=70)),
+    ("jpeg 768 q60 gray", dict(max_dimension=768, image_format="JPEG", quality=60, grayscale=True)),
+    ("webp 1024 q70", dict(max_dimension=1024, image_format="WEBP", quality=70)),
+]
+
+
+def load_captures(paths):
+    captures = []
+    for path in paths or [SCREENSHOTS_DIR]:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "*.png")))
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            print(f"Skipping {path}: no such file or directory.")
+            continue
+        for png_path in files:
+            with open(png_path, "rb") as f:
+                screenshot = f.read()
+            xml_path = os.path.splitext(png_path)[0] + ".xml"
+            ui_tree = None
+            if os.path.exists(xml_path):
+                with open(xml_path, encoding="utf-8") as f:
+                    ui_tree = UiTree(f.read())
+            captures.append((png_path, screenshot, ui_tree))
+    return captures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="PNG screenshots or directories of screenshots")
+    args = parser.parse_args()
+
+    captures = load_captures(args.paths)
+    if not captures:
+        print(f"No screenshots found. Capture some with driver.save_screenshot() into {SCREENSHOTS_DIR} "
+              f"or pass paths explicitly.")
+        return
+
+    raw_total = sum(len(screenshot) for _, screenshot, _ in captures)
+    print(f"{len(captures)} screenshots, {raw_total / 1024:.0f} KB raw PNG\n")
+    print(f"{'configuration':20} {'sent KB':>9} {'avg KB':>8} {'avg ms':>8} {'skipped':>8} {'saved':>7}")
+    for name, settings in CONFIGURATIONS:
+        pipeline = ScreenshotPipeline(**settings)
+        sent = 0
+        encode_seconds = 0.0
+        skipped = 0
+        for _, screenshot, ui_tree in captures:
+            processed = pipeline.process(screenshot, ui_tree)
+            sent += processed.encoded_bytes
+            encode_seconds += processed.encode_seconds
+            skipped += processed.unchanged
+        encoded = len(captures) - skipped
+        avg_kb = sent / encoded / 1024 if encoded else 0.0
+        print(f"{name:20} {sent / 1024:>9.0f} {avg_kb:>8.1f} {encode_seconds * 1000 / len(captures):>8.1f} "
+              f"{skipped:>8} {1 - sent / raw_total:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
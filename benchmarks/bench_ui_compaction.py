@@ -0,0 +1,71 @@
+"""
+Benchmarks UI-tree compaction on captured page_source dumps.
+
+Usage:
+    python benchmarks/bench_ui_compaction.py [dump.xml | dump_dir ...] [--budget BYTES]
+
+With no paths, runs over every *.xml file in benchmarks/dumps/.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ui_compaction import DEFAULT_UI_TREE_BUDGET, compact_ui_tree, estimate_tokens
+
+DUMPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dumps")
+
+
+def collect_dump_paths(paths):
+    dump_paths = []
+    for path in paths or [DUMPS_DIR]:
+        if os.path.isdir(path):
+            dump_paths.extend(sorted(glob.glob(os.path.join(path, "*.xml"))))
+        else:
+            dump_paths.append(path)
+    return dump_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="page_source XML dumps or directories of dumps")
+    parser.add_argument("--budget", type=int, default=DEFAULT_UI_TREE_BUDGET, help="compact tree size budget in bytes")
+    parser.add_argument("--repeat", type=int, default=20, help="compaction runs per dump for timing")
+    args = parser.parse_args()
+
+    dump_paths = collect_dump_paths(args.paths)
+    if not dump_paths:
+        print("No page_source dumps found.")
+        return
+
+    print(f"{'dump':40} {'raw B':>9} {'compact B':>10} {'raw tok':>8} {'cmp tok':>8} {'saved':>7} {'ms':>7}")
+    total_raw = total_compact = 0
+    total_raw_tokens = total_compact_tokens = 0
+    for path in dump_paths:
+        with open(path, encoding="utf-8") as f:
+            xml_text = f.read()
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            compacted = compact_ui_tree(xml_text, max_bytes=args.budget)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+        raw_tokens = estimate_tokens(xml_text)
+        compact_tokens = estimate_tokens(compacted.text)
+        total_raw += compacted.original_bytes
+        total_compact += compacted.compact_bytes
+        total_raw_tokens += raw_tokens
+        total_compact_tokens += compact_tokens
+        print(f"{os.path.basename(path)[:40]:40} {compacted.original_bytes:>9} {compacted.compact_bytes:>10} "
+              f"{raw_tokens:>8} {compact_tokens:>8} {compacted.reduction:>7.1%} {elapsed_ms:>7.2f}")
+
+    if total_raw:
+        print(f"\nTotal: {total_raw} -> {total_compact} bytes ({1 - total_compact / total_raw:.1%} smaller), "
+              f"~{total_raw_tokens} -> ~{total_compact_tokens} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Fake Appium driver for offline benchmarks.
+
+Serves recorded page_source dumps (and screenshots, when a scenario has them)
+for a small state machine of screens, and simulates the latency of each Appium
+round-trip. Clicks and taps flip the checked state of checkable widgets and
+follow the scenario's transitions, so an agent can actually work through a goal:
+
+    {
+      "start": "main_menu",
+      "screens": {
+        "main_menu": {"dump": "dumps/apidemos_main_menu.xml", "on_click": {"Preference": "preference_menu"}},
+        "preference_menu": {"dump": "dumps/apidemos_preference_menu.xml", "on_back": "main_menu",
+                            "on_scroll": {"down": "preference_menu_end"}}
+      }
+    }
+
+on_click keys match the exact text or content-desc of the clicked element or of
+anything inside it. Screens without a recorded screenshot get a synthetic PNG
+drawn from the element bounds, so image size and the unchanged-frame check
+behave roughly like on a device.
+"""
+import os
+import struct
+import time
+import xml.etree.ElementTree as ET
+import zlib
+
+from selenium.common.exceptions import NoSuchElementException
+
+from element_index import MISSING, UNSUPPORTED, ElementIndex
+from ui_compaction import STATE_TEXTS, UiTree
+
+# Simulated seconds per Appium round-trip, roughly what UiAutomator2 on an emulator takes
+DEFAULT_LATENCIES = {
+    "page_source": 0.35,
+    "screenshot": 0.45,
+    "find_element": 0.15,
+    "action": 0.25,
+    "command": 0.05,
+}
+KEYCODE_BACK = 4
+
+
+def _png(width, height, rows):
+    """Encodes RGB rows (bytes of width * 3) as a PNG with the standard library only."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    raw = b"".join(b"\x00" + bytes(row) for row in rows)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+
+def _shade(value):
+    """Stable mid-gray-ish colour for a label, so different texts draw differently."""
+    digest = zlib.crc32(value.encode("utf-8"))
+    return bytes((80 + digest % 120, 80 + (digest >> 8) % 120, 80 + (digest >> 16) % 120))
+
+
+class FakeElement:
+    def __init__(self, driver, element):
+        self._driver = driver
+        self._element = element
+
+    @property
+    def text(self):
+        return self._element.get("text", "")
+
+    def get_attribute(self, name):
+        return self._element.get(name)
+
+    def is_displayed(self):
+        return self._element.get("displayed") != "false"
+
+    def click(self):
+        self._driver._sleep("action")
+        self._driver._activate(self._element)
+
+    def send_keys(self, text):
+        self._driver._sleep("action")
+        self._element.set("text", self._element.get("text", "") + str(text))
+
+
+class FakeDriver:
+    """Stand-in for an appium.webdriver.Remote session, driven by a scenario dict."""
+
+    def __init__(self, scenario, base_dir=".", latency_scale=1.0, latencies=None, clock=None):
+        self.scenario = scenario
+        self.base_dir = base_dir
+        self.latency_scale = latency_scale
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.clock = clock  # optional PhaseClock; captures are timed as "perception"
+        self.current = scenario["start"]
+        self.app_running = True
+        self.calls = {}
+        self.simulated_seconds = 0.0
+        self._roots = {}  # screen name -> mutable ElementTree root, so toggles persist
+        self._png_cache = {}
+
+    # --- Scenario state ---
+    @property
+    def screen(self):
+        return self.scenario["screens"][self.current]
+
+    def _root(self):
+        if self.current not in self._roots:
+            with open(os.path.join(self.base_dir, self.screen["dump"]), "rb") as f:
+                self._roots[self.current] = ET.fromstring(f.read())
+        return self._roots[self.current]
+
+    def _xml(self):
+        return "<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>" + ET.tostring(self._root(), encoding="unicode")
+
+    def _tree(self):
+        """UiTree of the current screen plus a map from its nodes back to the mutable elements."""
+        root = self._root()
+        tree = UiTree(self._xml())
+        elements = list(root.iter())
+        if root.tag == "hierarchy":
+            elements = elements[1:]
+        return tree, dict(zip((id(node) for node in tree.nodes), elements))
+
+    def _sleep(self, kind):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        delay = self.latencies.get(kind, 0.0) * self.latency_scale
+        self.simulated_seconds += delay
+        if delay:
+            time.sleep(delay)
+
+    def _go(self, target):
+        if target:
+            self.current = target
+
+    def _activate(self, element):
+        """A click: toggle the checkable widget it hits, then follow the screen's on_click transition."""
+        checkables = [e for e in element.iter() if e.get("checkable") == "true"]
+        if checkables:
+            widget = checkables[0]
+            checked = widget.get("checked") != "true"
+            widget.set("checked", "true" if checked else "false")
+            if widget.get("text", "").upper() in STATE_TEXTS:
+                widget.set("text", "ON" if checked else "OFF")
+        labels = {e.get(name) for e in element.iter() for name in ("text", "content-desc") if e.get(name)}
+        for label, target in self.screen.get("on_click", {}).items():
+            if label in labels:
+                self._go(target)
+                return
+
+    # --- Perception ---
+    @property
+    def page_source(self):
+        if self.clock:
+            with self.clock.phase("perception"):
+                self._sleep("page_source")
+                return self._xml()
+        self._sleep("page_source")
+        return self._xml()
+
+    def get_screenshot_as_png(self):
+        if self.clock:
+            with self.clock.phase("perception"):
+                self._sleep("screenshot")
+                return self._screenshot()
+        self._sleep("screenshot")
+        return self._screenshot()
+
+    def _screenshot(self):
+        if self.screen.get("screenshot"):
+            with open(os.path.join(self.base_dir, self.screen["screenshot"]), "rb") as f:
+                return f.read()
+        xml_text = self._xml()
+        if xml_text not in self._png_cache:
+            self._png_cache[xml_text] = self._render(UiTree(xml_text))
+        return self._png_cache[xml_text]
+
+    def _render(self, tree):
+        _, _, width, height = tree.screen or (0, 0, 1080, 2400)
+        rows = [bytearray(b"\xf0\xf0\xf0" * width) for _ in range(height)]
+        for node in tree.nodes:
+            if node.bounds is None or not node.is_visible(tree.screen):
+                continue
+            if node.get("checkable") == "true":
+                colour = b"\x20\x90\x40" if node.flag("checked") else b"\x90\x90\x90"
+            elif node.text or node.content_desc:
+                colour = _shade(node.text or node.content_desc)
+            elif node.flag("clickable"):
+                colour = b"\xe4\xe4\xe4"
+            else:
+                continue
+            left, top, right, bottom = (max(0, node.bounds[0]), max(0, node.bounds[1]),
+                                        min(width, node.bounds[2]), min(height, node.bounds[3]))
+            if right <= left or bottom <= top:
+                continue
+            fill = colour * (right - left)
+            for y in range(top, bottom):
+                rows[y][left * 3:right * 3] = fill
+        return _png(width, height, rows)
+
+    def save_screenshot(self, path):
+        return True
+
+    # --- Elements and actions ---
+    def find_element(self, by="id", value=None):
+        self._sleep("find_element")
+        tree, elements = self._tree()
+        resolution = ElementIndex(tree).resolve(_appium_by_name(by), value)
+        if resolution.status in (MISSING, UNSUPPORTED):
+            raise NoSuchElementException(f"No element matches {by}={value!r} on screen '{self.current}'")
+        return FakeElement(self, elements[id(resolution.node)])
+
+    def find_elements(self, by="id", value=None):
+        try:
+            return [self.find_element(by, value)]
+        except NoSuchElementException:
+            return []
+
+    def tap(self, positions, duration=None):
+        self._sleep("action")
+        x, y = positions[0]
+        tree, elements = self._tree()
+        hits = [n for n in tree.nodes if n.bounds and n.is_visible(tree.screen)
+                and n.bounds[0] <= x < n.bounds[2] and n.bounds[1] <= y < n.bounds[3]]
+        clickable = [n for n in hits if n.flag("clickable") or n.get("checkable") == "true"]
+        if clickable:
+            self._activate(elements[id(clickable[-1])])  # deepest hit wins, like a real touch
+
+    def execute_script(self, script, args=None):
+        self._sleep("action")
+        if script == "mobile: scrollGesture":
+            target = self.screen.get("on_scroll", {}).get((args or {}).get("direction", "down"))
+            self._go(target)
+            return bool(target)  # scrollGesture returns whether more scrolling is possible
+        return None
+
+    def press_keycode(self, keycode, metastate=None, flags=None):
+        self._sleep("action")
+        if keycode == KEYCODE_BACK:
+            self._go(self.screen.get("on_back"))
+
+    def activate_app(self, app_id):
+        self._sleep("action")
+        if not self.app_running:
+            self.current = self.scenario["start"]  # app data (e.g. toggled preferences) survives, as with noReset
+            self.app_running = True
+
+    def terminate_app(self, app_id, **options):
+        self._sleep("action")
+        self.app_running = False
+        return True
+
+    def get_window_size(self, window_handle="current"):
+        self._sleep("command")
+        root = self._root()
+        return {"width": int(root.get("width", 1080)), "height": int(root.get("height", 2400))}
+
+    def update_settings(self, settings):
+        self._sleep("command")
+
+    def quit(self):
+        pass
+
+
+def _appium_by_name(by):
+    """Maps an AppiumBy/By value ('id', 'accessibility id', 'xpath', ...) to the element index's names."""
+    return {"id": "ID", "accessibility id": "ACCESSIBILITY_ID", "xpath": "XPATH",
+            "class name": "CLASS_NAME"}.get(str(by).lower(), str(by).upper())
@@ -0,0 +1,137 @@
+"""
+Scripted stand-in for genai.GenerativeModel, for offline benchmarks.
+
+Replays canned responses in order and records what each request would have
+cost: input bytes (system instruction, history and prompt parts) and estimated
+tokens, using Gemini's flat per-image token charge for screenshots. Latency is
+simulated from a fixed base plus a per-token cost. With stream=True the reply
+arrives in chunks spread over the output-token time, and a stream closed early
+only costs the chunks that were read. A generation_config asking for JSON output
+gets the bare action JSON instead of a thought followed by a fenced block.
+"""
+import json
+import time
+
+from conversation_memory import part_bytes
+from ui_compaction import estimate_tokens
+
+# Gemini bills an image of up to 384x384 as 258 tokens and larger ones in 768x768 tiles of 258 each;
+# a downscaled phone screenshot is typically 2 tiles
+TOKENS_PER_IMAGE = 2 * 258
+DEFAULT_BASE_LATENCY = 1.2
+DEFAULT_SECONDS_PER_1K_INPUT_TOKENS = 0.15
+DEFAULT_SECONDS_PER_1K_OUTPUT_TOKENS = 4.0
+
+STREAM_CHUNK_CHARS = 40
+
+EXHAUSTED_RESPONSE = {"action": "GOAL_IMPOSSIBLE", "thought": "Scripted responses exhausted."}
+
+
+def render_response(response, json_output=False):
+    """Canned responses are raw strings, or action dicts that get wrapped like a real reply."""
+    if isinstance(response, str):
+        return response
+    if json_output:
+        return json.dumps(response)
+    thought = response.get("thought", "") if isinstance(response, dict) else ""
+    return f"{thought}\n```json\n{json.dumps(response)}\n```\nThis action moves the goal forward.".strip()
+
+
+def _part_tokens(part):
+    if isinstance(part, str):
+        return estimate_tokens(part)
+    return TOKENS_PER_IMAGE
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamResponse:
+    """Iterates the reply in chunks; closing _iterator (as the planner does) stops the generation."""
+
+    def __init__(self, text, usage_metadata, first_chunk_seconds, seconds_per_char, request):
+        self.usage_metadata = usage_metadata
+        self._request = request
+        self._iterator = self._chunks(text, first_chunk_seconds, seconds_per_char)
+
+    def _chunks(self, text, first_chunk_seconds, seconds_per_char):
+        self._request["seconds"] = 0.0
+        for offset in range(0, len(text), STREAM_CHUNK_CHARS):
+            piece = text[offset:offset + STREAM_CHUNK_CHARS]
+            delay = (first_chunk_seconds if offset == 0 else 0.0) + seconds_per_char * len(piece)
+            if delay:
+                time.sleep(delay)
+            self._request["seconds"] += delay
+            self._request["streamed_chars"] = offset + len(piece)
+            yield FakeChunk(piece)
+
+    def __iter__(self):
+        return self._iterator
+
+
+class FakeChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, generation_config=None, **kwargs):
+        parts = content if isinstance(content, list) else [content]
+        json_output = bool(generation_config and generation_config.get("response_mime_type") == "application/json")
+        return self.model._respond(self.history, parts, stream, json_output)
+
+
+class FakeGenerativeModel:
+    """Replays `responses` one per request and records the request sizes."""
+
+    def __init__(self, responses, model_name="fake-gemini", system_instruction=None, latency_scale=1.0,
+                 base_latency=DEFAULT_BASE_LATENCY, seconds_per_1k_input_tokens=DEFAULT_SECONDS_PER_1K_INPUT_TOKENS,
+                 seconds_per_1k_output_tokens=DEFAULT_SECONDS_PER_1K_OUTPUT_TOKENS):
+        self.responses = list(responses)
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.latency_scale = latency_scale
+        self.base_latency = base_latency
+        self.seconds_per_1k_input_tokens = seconds_per_1k_input_tokens
+        self.seconds_per_1k_output_tokens = seconds_per_1k_output_tokens
+        self.requests = []  # one dict per call: input_bytes, input_tokens, output_tokens, images, seconds, streamed
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+    def _respond(self, history, parts, stream=False, json_output=False):
+        all_parts = [part for message in history for part in message["parts"]] + parts
+        if self.system_instruction:
+            all_parts.insert(0, self.system_instruction)
+        input_bytes = sum(part_bytes(part) for part in all_parts)
+        input_tokens = sum(_part_tokens(part) for part in all_parts)
+        images = sum(1 for part in all_parts if not isinstance(part, str))
+
+        text = render_response(self.responses.pop(0) if self.responses else EXHAUSTED_RESPONSE, json_output)
+        output_tokens = estimate_tokens(text)
+        first_token_seconds = self.latency_scale * (self.base_latency
+                                                    + input_tokens / 1000 * self.seconds_per_1k_input_tokens)
+        output_seconds = self.latency_scale * output_tokens / 1000 * self.seconds_per_1k_output_tokens
+        request = {"input_bytes": input_bytes, "input_tokens": input_tokens, "output_tokens": output_tokens,
+                   "images": images, "seconds": first_token_seconds + output_seconds, "streamed": stream}
+        self.requests.append(request)
+        usage = FakeUsageMetadata(input_tokens, output_tokens)
+        if stream:
+            return FakeStreamResponse(text, usage, first_token_seconds, output_seconds / max(1, len(text)), request)
+        if request["seconds"]:
+            time.sleep(request["seconds"])
+        return FakeResponse(text, usage)
@@ -0,0 +1,136 @@
+"""
+Bounded conversation memory for GeminiAgent.
+
+Instead of re-sending convo.history (every earlier screenshot and UI tree) on
+each call, the agent keeps its own turn records and rebuilds a small history:
+
+* "full"   - legacy behaviour: every earlier turn verbatim, images and UI trees included.
+* "window" - only the last `window_turns` turns, with images and UI trees stripped.
+* "digest" - the window, plus a one-line digest (action, locator, outcome, screen
+             fingerprint) for every older turn. This is the default.
+"""
+from ui_compaction import estimate_tokens
+
+MEMORY_MODES = ("full", "window", "digest")
+DEFAULT_MEMORY_MODE = "digest"
+DEFAULT_WINDOW_TURNS = 3
+
+
+class TurnRecord:
+    """What the agent remembers about one Perceive-Plan-Act turn."""
+
+    def __init__(self, index, fingerprint, prompt_text, full_parts, full_bytes, model_text, action):
+        self.index = index
+        self.fingerprint = fingerprint
+        self.prompt_text = prompt_text  # text-only user message (no screenshot, no UI tree)
+        self.full_parts = full_parts    # the original user message, only kept in "full" mode
+        self.full_bytes = full_bytes
+        self.model_text = model_text
+        self.action = action or {}
+        self.outcome = "pending"
+
+    def digest(self):
+        if self.action.get("steps"):  # batched plan
+            summary = "plan [" + ", ".join(describe_action(step) for step in self.action["steps"]) + "]"
+        else:
+            summary = describe_action(self.action)
+        return f"Turn {self.index}: {summary} -> {self.outcome} (screen {self.fingerprint})"
+
+
+def describe_action(action):
+    """Short one-line form of an action, e.g. 'click ID=android:id/switch_widget'."""
+    action_type = action.get("action", "?")
+    locator = ""
+    if action.get("by"):
+        locator = f" {action['by']}={action.get('value')}"
+    elif action.get("action") == "scroll_to":
+        target = next((f"{key}={action[key]}" for key in ("text", "desc", "id") if action.get(key)), "?")
+        locator = f" {target} {action.get('direction', 'down')}"
+    elif action.get("direction"):
+        locator = f" {action['direction']}"
+    elif action.get("key_code") is not None:
+        locator = f" {action['key_code']}"
+    return f"{action_type}{locator}"
+
+
+def part_bytes(part, image_bytes=0):
+    """Approximate request size of one prompt part; non-text parts count as image_bytes."""
+    if isinstance(part, str):
+        return len(part.encode("utf-8"))
+    if isinstance(part, (bytes, bytearray)):
+        return len(part)
+    if isinstance(part, dict) and "data" in part:  # inline blob, e.g. an encoded screenshot
+        return len(part["data"])
+    return image_bytes
+
+
+class ConversationMemory:
+    """Keeps a bounded, summarized history of earlier turns for the chat session."""
+
+    def __init__(self, mode=DEFAULT_MEMORY_MODE, window_turns=DEFAULT_WINDOW_TURNS):
+        if mode not in MEMORY_MODES:
+            raise ValueError(f"Unknown memory mode '{mode}'. Expected one of {MEMORY_MODES}.")
+        self.mode = mode
+        self.window_turns = window_turns
+        self.turns = []
+        self.payload_sizes = []  # request bytes per turn, for checking growth over a run
+
+    def reset(self):
+        self.turns = []
+        self.payload_sizes = []
+
+    def build_history(self):
+        """Returns the history (list of role/parts dicts) to start the next chat call with."""
+        history = []
+        if self.mode == "full":
+            for turn in self.turns:
+                history.append({"role": "user", "parts": turn.full_parts or [turn.prompt_text]})
+                history.append({"role": "model", "parts": [turn.model_text]})
+            return history
+
+        recent = self.turns[-self.window_turns:] if self.window_turns > 0 else []
+        older = self.turns[:len(self.turns) - len(recent)]
+        if self.mode == "digest" and older:
+            summary = "Summary of earlier turns (oldest first):\n" + "\n".join(t.digest() for t in older)
+            history.append({"role": "user", "parts": [summary]})
+            history.append({"role": "model", "parts": ["Noted."]})
+        for turn in recent:
+            history.append({"role": "user", "parts": [turn.prompt_text]})
+            history.append({"role": "model", "parts": [turn.model_text]})
+        return history
+
+    def history_bytes(self, history):
+        if self.mode == "full":
+            # Full-mode history re-sends each turn's original parts, which were measured (encoded image data included) when recorded
+            return sum(turn.full_bytes + len(turn.model_text.encode("utf-8")) for turn in self.turns)
+        return sum(part_bytes(part) for message in history for part in message["parts"])
+
+    def record_request(self, history, prompt_parts, image_bytes=0):
+        """Records and prints the request size for the call about to be made."""
+        history_size = self.history_bytes(history)
+        current_size = sum(part_bytes(part, image_bytes) for part in prompt_parts)
+        total = history_size + current_size
+        self.payload_sizes.append(total)
+        text_tokens = sum(estimate_tokens(part) for part in prompt_parts if isinstance(part, str))
+        print(f"[Memory]: Turn {len(self.turns) + 1} request payload ({self.mode}): history {history_size / 1024:.1f} KB "
+              f"in {len(history)} messages + current {current_size / 1024:.1f} KB (~{text_tokens} text tokens) "
+              f"= {total / 1024:.1f} KB")
+        return total
+
+    def payload_summary(self):
+        if not self.payload_sizes:
+            return "[Memory]: No model requests were made."
+        sizes_kb = ", ".join(f"{size / 1024:.1f}" for size in self.payload_sizes)
+        return (f"[Memory]: Request payload per turn ({self.mode}, KB): {sizes_kb} "
+                f"(first {self.payload_sizes[0] / 1024:.1f}, max {max(self.payload_sizes) / 1024:.1f})")
+
+    def record_turn(self, fingerprint, prompt_text, full_parts, full_bytes, model_text, action):
+        turn = TurnRecord(len(self.turns) + 1, fingerprint, prompt_text,
+                          full_parts if self.mode == "full" else None, full_bytes, model_text, action)
+        self.turns.append(turn)
+        return turn
+
+    def record_outcome(self, outcome):
+        """Attaches the execution outcome (e.g. 'success', 'failed: element_not_found') to the latest turn."""
+        if self.turns:
+            self.turns[-1].outcome = outcome
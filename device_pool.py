@@ -0,0 +1,241 @@
+"""
+Device-pool scheduler: runs a list of goals concurrently across several devices.
+
+Each device gets its own worker thread and Appium session; goals are pulled from
+a shared queue, so throughput scales with the number of devices. Model calls from
+all workers go through one ModelRateLimiter. Before every goal the worker health-
+checks its session and reconnects if needed; a goal whose session died mid-run is
+retried on another device.
+
+The pool only talks to drivers through the callables it is given
+(driver_factory, goal_runner, health_check), so it runs unchanged against a fake
+driver:
+
+    pool = DevicePool([{"appium:udid": "fake-1"}, {"appium:udid": "fake-2"}],
+                      driver_factory=lambda caps: FakeDriver(caps),
+                      goal_runner=lambda driver, goal: {"status": "Goal_Achieved"})
+    results = pool.run(["goal A", "goal B", "goal C"])
+"""
+import queue
+import threading
+import time
+
+DEFAULT_MAX_CONCURRENT_MODEL_CALLS = 4
+DEFAULT_MODEL_CALLS_PER_MINUTE = 60
+DEFAULT_MAX_ATTEMPTS = 2
+
+# Goal statuses that may mean the session died rather than the goal failing on its merits
+SESSION_FAILURE_STATUSES = ("Perception_Failed", "Overall_System_Error")
+
+
+class ModelRateLimiter:
+    """Context manager capping concurrent model calls and their start rate across all workers."""
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_MODEL_CALLS, calls_per_minute=DEFAULT_MODEL_CALLS_PER_MINUTE):
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._interval = 60.0 / calls_per_minute if calls_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self.calls = 0
+        self.waited_seconds = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next_start - now)
+            self._next_start = max(now, self._next_start) + self._interval
+            self.calls += 1
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.waited_seconds += time.perf_counter() - start
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+
+def default_health_check(driver):
+    """Cheap liveness probe: any round-trip that needs a live session."""
+    driver.get_window_size()
+    return True
+
+
+def device_label(device_capabilities):
+    return (device_capabilities.get("appium:udid") or device_capabilities.get("appium:deviceName")
+            or device_capabilities.get("deviceName") or "device")
+
+
+class GoalResult:
+    """Outcome of one goal in a pool run."""
+
+    def __init__(self, goal, status, device=None, attempts=0, seconds=0.0, details=None):
+        self.goal = goal
+        self.status = status
+        self.device = device
+        self.attempts = attempts
+        self.seconds = seconds
+        self.details = details or {}
+
+    def __repr__(self):
+        return f"GoalResult(status={self.status!r}, device={self.device!r}, attempts={self.attempts}, seconds={self.seconds:.1f})"
+
+
+class _Job:
+    def __init__(self, index, goal):
+        self.index = index
+        self.goal = goal
+        self.attempts = 0
+        self.failed_devices = set()
+
+
+class DevicePool:
+    """Runs goals concurrently, one worker thread and Appium session per device."""
+
+    def __init__(self, device_capabilities, driver_factory, goal_runner, health_check=default_health_check,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, rate_limiter=None):
+        if not device_capabilities:
+            raise ValueError("DevicePool needs at least one device capability set.")
+        self.device_capabilities = list(device_capabilities)
+        self.driver_factory = driver_factory
+        self.goal_runner = goal_runner
+        self.health_check = health_check
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter or ModelRateLimiter()
+        self._jobs = queue.Queue()
+        self._results = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._live_devices = set()
+
+    def run(self, goals):
+        """Runs every goal and returns GoalResults in the order the goals were given."""
+        start = time.perf_counter()
+        goals = list(goals)
+        self._results = {}
+        self._pending = len(goals)
+        self._live_devices = {device_label(caps) for caps in self.device_capabilities}
+        for index, goal in enumerate(goals):
+            self._jobs.put(_Job(index, goal))
+
+        workers = [threading.Thread(target=self._worker, args=(caps,), name=f"device-{device_label(caps)}", daemon=True)
+                   for caps in self.device_capabilities]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # Anything left over had no live device to run on
+        while not self._jobs.empty():
+            job = self._jobs.get_nowait()
+            self._results[job.index] = GoalResult(job.goal, "No_Device_Available", attempts=job.attempts)
+
+        results = [self._results[i] for i in range(len(goals))]
+        self._print_summary(results, time.perf_counter() - start)
+        return results
+
+    def _finish(self, job, result):
+        with self._lock:
+            self._results[job.index] = result
+            self._pending -= 1
+
+    def _worker(self, device_capabilities):
+        label = device_label(device_capabilities)
+        driver = None
+        try:
+            while True:
+                with self._lock:
+                    if self._pending <= 0:
+                        return
+                try:
+                    job = self._jobs.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                # Prefer another device for a goal whose session died here before
+                with self._lock:
+                    others_alive = bool(self._live_devices - job.failed_devices - {label})
+                if label in job.failed_devices and others_alive:
+                    self._jobs.put(job)
+                    time.sleep(0.05)
+                    continue
+
+                driver = self._ensure_session(driver, device_capabilities, label)
+                if driver is None:
+                    self._jobs.put(job)
+                    with self._lock:
+                        self._live_devices.discard(label)
+                    return
+
+                self._run_job(job, driver, label)
+                if label in job.failed_devices:
+                    # The session died during this goal; drop it so the next goal reconnects
+                    self._quit(driver, label)
+                    driver = None
+        finally:
+            if driver is not None:
+                self._quit(driver, label)
+            with self._lock:
+                self._live_devices.discard(label)
+                if not self._live_devices:
+                    self._pending = 0  # wake the other workers; nothing can run any more
+
+    def _ensure_session(self, driver, device_capabilities, label):
+        """Returns a healthy driver for this device, reconnecting once if the current one is dead."""
+        if driver is not None:
+            try:
+                if self.health_check(driver):
+                    return driver
+            except Exception as e:
+                print(f"[Device Pool]: Session on {label} failed its health check: {e}. Reconnecting.")
+            self._quit(driver, label)
+        try:
+            print(f"[Device Pool]: Starting session on {label}...")
+            driver = self.driver_factory(device_capabilities)
+            self.health_check(driver)
+            return driver
+        except Exception as e:
+            print(f"[Device Pool ERROR]: Could not start a healthy session on {label}: {e}. Retiring device.")
+            return None
+
+    def _run_job(self, job, driver, label):
+        job.attempts += 1
+        start = time.perf_counter()
+        try:
+            details = self.goal_runner(driver, job.goal) or {}
+            status = details.get("status", "Unknown")
+        except Exception as e:
+            details = {"error": str(e)}
+            status = f"Overall_System_Error: {e}"
+        elapsed = time.perf_counter() - start
+
+        if status.startswith(SESSION_FAILURE_STATUSES) and not self._is_healthy(driver):
+            job.failed_devices.add(label)
+            if job.attempts < self.max_attempts:
+                print(f"[Device Pool]: Session on {label} died during a goal; retrying it on another device.")
+                self._jobs.put(job)
+                return
+        self._finish(job, GoalResult(job.goal, status, label, job.attempts, elapsed, details))
+
+    def _is_healthy(self, driver):
+        try:
+            return bool(self.health_check(driver))
+        except Exception:
+            return False
+
+    def _quit(self, driver, label):
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"[Device Pool WARNING]: Error while quitting session on {label}: {e}")
+
+    def _print_summary(self, results, wall_seconds):
+        print(f"\n[Device Pool]: {len(results)} goals on {len(self.device_capabilities)} devices in {wall_seconds:.1f}s "
+              f"({len(results) / wall_seconds * 60 if wall_seconds else 0:.1f} goals/min).")
+        for label in sorted({r.device for r in results if r.device}):
+            mine = [r for r in results if r.device == label]
+            busy = sum(r.seconds for r in mine)
+            print(f"   {label}: {len(mine)} goals, {busy:.1f}s busy ({busy / wall_seconds:.0%} utilization)")
+        print(f"   model calls: {self.rate_limiter.calls}, {self.rate_limiter.waited_seconds:.1f}s spent waiting on the rate limit")
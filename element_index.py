@@ -0,0 +1,387 @@
+"""
+Local element index over the page_source captured at perception time.
+
+Every click/type used to go through a 30 s WebDriverWait, so a locator Gemini
+made up cost a full timeout before the failure was fed back. The index resolves
+ID, ACCESSIBILITY_ID, CLASS_NAME and the XPath subset UiAutomator2 locators use
+in-process, so an invalid locator fails immediately with the closest matching
+elements as suggestions, and an unambiguous match can be tapped by its bounds.
+"""
+import difflib
+import re
+
+from ui_compaction import UiNode, UiTree, bounds_center
+
+# Resolution outcomes
+UNIQUE = "unique"
+AMBIGUOUS = "ambiguous"
+MISSING = "missing"
+UNSUPPORTED = "unsupported"  # locator the index cannot evaluate; leave it to the server
+
+
+class XPathUnsupported(Exception):
+    """Raised for XPath syntax outside the subset the local evaluator handles."""
+
+
+class Resolution:
+    """Result of resolving one locator against the index."""
+
+    def __init__(self, status, nodes=(), suggestions=()):
+        self.status = status
+        self.nodes = list(nodes)
+        self.suggestions = list(suggestions)
+
+    @property
+    def node(self):
+        return self.nodes[0] if self.nodes else None
+
+    @property
+    def center(self):
+        """Tap point for a unique match with known bounds, else None."""
+        if self.status != UNIQUE or self.node.bounds is None:
+            return None
+        return bounds_center(self.node.bounds)
+
+
+class ElementIndex:
+    """Maps resource-id, content-desc, text and class to nodes, and evaluates XPath locally."""
+
+    def __init__(self, ui_tree):
+        self.tree = ui_tree if isinstance(ui_tree, UiTree) else UiTree(ui_tree)
+        self.by_resource_id = {}
+        self.by_content_desc = {}
+        self.by_text = {}
+        self.by_class = {}
+        for node in self.tree.nodes:
+            for mapping, key in ((self.by_resource_id, node.resource_id), (self.by_content_desc, node.content_desc),
+                                 (self.by_text, node.text), (self.by_class, node.class_name)):
+                if key:
+                    mapping.setdefault(key, []).append(node)
+
+    def resolve(self, by, value):
+        """Resolves an Appium (by, value) locator to nodes; see the module-level status constants."""
+        by = str(by).upper()
+        try:
+            if by == "ID":
+                nodes = self._by_id(value)
+            elif by == "ACCESSIBILITY_ID":
+                nodes = self.by_content_desc.get(value, [])
+            elif by == "CLASS_NAME":
+                nodes = self.by_class.get(value, [])
+            elif by == "XPATH":
+                nodes = evaluate_xpath(self.tree, value)
+            else:
+                return Resolution(UNSUPPORTED)
+        except XPathUnsupported:
+            return Resolution(UNSUPPORTED)
+
+        if not nodes:
+            return Resolution(MISSING, suggestions=self.suggest(value))
+        return Resolution(UNIQUE if len(nodes) == 1 else AMBIGUOUS, nodes)
+
+    def _by_id(self, value):
+        if ":id/" in value:
+            return self.by_resource_id.get(value, [])
+        # UiAutomator2 prefixes a bare id with the app package; accept any package here
+        return [n for rid, nodes in self.by_resource_id.items() if rid.endswith(":id/" + value) for n in nodes]
+
+    def suggest(self, value, limit=3):
+        """Returns up to `limit` visible nodes whose id, content-desc or text is closest to value."""
+        queries = re.findall(r"\"([^\"]*)\"|'([^']*)'", value)
+        queries = [a or b for a, b in queries] or [value]
+        scored = []
+        for node in self.tree.nodes:
+            if not (node.is_interactive or node.is_informative) or not node.is_visible(self.tree.screen):
+                continue
+            candidates = [c for c in (node.text, node.content_desc, node.resource_id.split("/", 1)[-1]) if c]
+            score = max((difflib.SequenceMatcher(None, q.lower(), c.lower()).ratio()
+                         for q in queries for c in candidates), default=0)
+            if score >= 0.5:
+                scored.append((score, node))
+        scored.sort(key=lambda item: -item[0])
+        return [node for _, node in scored[:limit]]
+
+    def describe(self, node):
+        """One-line description of a node and its best locator, for feedback to Gemini."""
+        by, value = self.tree.locator_for(node)
+        label = node.text or node.content_desc
+        label = f" '{label}'" if label else ""
+        return f"By={by}, Value='{value}' ({node.short_class}{label}, handle {node.handle})"
+
+
+# --- Local XPath evaluation (the subset used for UiAutomator2 locators) ---
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<string>"[^"]*"|'[^']*') |
+    (?P<number>\d+(?:\.\d+)?) |
+    (?P<op>//|/|\[|\]|\(|\)|@|,|!=|=|\.\.|\.|\*|\|) |
+    (?P<name>[A-Za-z_][\w.\-]*)
+)""", re.VERBOSE)
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if not match or match.end() == position:
+            raise XPathUnsupported(f"Unexpected character at {position} in {expression!r}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "string":
+            tokens.append(("string", text[1:-1]))
+        elif kind == "number":
+            tokens.append(("number", float(text)))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing a small tuple-based AST."""
+
+    def __init__(self, expression):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token[0] is None or (expected is not None and token[1] != expected):
+            raise XPathUnsupported(f"Expected {expected!r}, got {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        expr = self.parse_location()
+        if self.peek()[0] is not None:
+            raise XPathUnsupported(f"Unexpected token {self.peek()[1]!r}")
+        return expr
+
+    def parse_location(self):
+        if self.peek()[1] == "(":
+            self.take("(")
+            inner = self.parse_location()
+            self.take(")")
+            return ("filter", inner, self.parse_predicates())
+        return self.parse_path()
+
+    def parse_path(self):
+        absolute = self.peek()[1] in ("/", "//")
+        steps = []
+        separator = self.take()[1] if absolute else "/"
+        while True:
+            steps.append((separator == "//",) + self.parse_step())
+            if self.peek()[1] in ("/", "//"):
+                separator = self.take()[1]
+            else:
+                break
+        return ("path", absolute, steps)
+
+    def parse_step(self):
+        kind, text = self.take()
+        if text == ".":
+            return "self", None, self.parse_predicates()
+        if text == "..":
+            return "parent", None, self.parse_predicates()
+        if text != "*" and kind != "name":
+            raise XPathUnsupported(f"Unsupported step {text!r}")
+        return "child", None if text == "*" else text, self.parse_predicates()
+
+    def parse_predicates(self):
+        predicates = []
+        while self.peek()[1] == "[":
+            self.take("[")
+            predicates.append(self.parse_or())
+            self.take("]")
+        return predicates
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.peek() == ("name", "or"):
+            self.take()
+            left = ("or", left, self.parse_and())
+        return left
+
+    def parse_and(self):
+        left = self.parse_comparison()
+        while self.peek() == ("name", "and"):
+            self.take()
+            left = ("and", left, self.parse_comparison())
+        return left
+
+    def parse_comparison(self):
+        left = self.parse_term()
+        if self.peek()[1] in ("=", "!="):
+            operator = self.take()[1]
+            return ("compare", operator, left, self.parse_term())
+        return left
+
+    def parse_term(self):
+        kind, text = self.peek()
+        if kind == "string":
+            self.take()
+            return ("literal", text)
+        if kind == "number":
+            self.take()
+            return ("literal", text)
+        if text == "@":
+            self.take()
+            return ("attr", self.take()[1])
+        if text == "(":
+            self.take("(")
+            inner = self.parse_or()
+            self.take(")")
+            return inner
+        if kind == "name" and self.peek(1)[1] == "(":
+            self.take()
+            self.take("(")
+            args = []
+            while self.peek()[1] != ")":
+                args.append(self.parse_or())
+                if self.peek()[1] == ",":
+                    self.take(",")
+            self.take(")")
+            return ("call", text, args)
+        if text in (".", "..", "/", "//", "*") or kind == "name":
+            return self.parse_path()
+        raise XPathUnsupported(f"Unsupported expression at {text!r}")
+
+
+class _VirtualNode:
+    """The document root and the <hierarchy> element, which UiTree does not keep as nodes."""
+
+    def __init__(self, tag, children, parent=None):
+        self.tag = tag
+        self.children = children
+        self.parent = parent
+
+
+def _tag(node):
+    return node.element.tag if isinstance(node, UiNode) else node.tag
+
+
+def _descendants_or_self(node):
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(current.children))
+
+
+def _string_value(value):
+    if isinstance(value, list):
+        # page_source elements carry everything in attributes, so their XPath string-value is empty
+        return "" if value else None
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else str(value)
+    return value
+
+
+class _Evaluator:
+    def __init__(self, tree):
+        self.order = {id(node): i for i, node in enumerate(tree.nodes)}
+        # /hierarchy is the document element in UiAutomator2 XPath
+        self.root = _VirtualNode(None, [])
+        self.root.children.append(_VirtualNode("hierarchy", tree.roots, self.root))
+
+    def sort(self, nodes):
+        unique = {id(n): n for n in nodes if id(n) in self.order}
+        return sorted(unique.values(), key=lambda n: self.order[id(n)])
+
+    def eval_location(self, expr, context):
+        if expr[0] == "filter":
+            return self.apply_predicates(self.eval_location(expr[1], context), expr[2])
+        _, absolute, steps = expr
+        current = [self.root] if absolute else [context]
+        for descendant, axis, name, predicates in steps:
+            next_nodes = []
+            for node in current:
+                bases = list(_descendants_or_self(node)) if descendant else [node]
+                for base in bases:
+                    if axis == "self":
+                        candidates = [base]
+                    elif axis == "parent":
+                        candidates = [base.parent] if getattr(base, "parent", None) else []
+                    else:
+                        candidates = [c for c in base.children if name is None or _tag(c) == name]
+                    next_nodes.extend(self.apply_predicates(candidates, predicates))
+            current = next_nodes
+        return self.sort(current)
+
+    def apply_predicates(self, nodes, predicates):
+        for predicate in predicates:
+            size = len(nodes)
+            kept = []
+            for position, node in enumerate(nodes, 1):
+                value = self.eval_expr(predicate, node, position, size)
+                if isinstance(value, float):
+                    if value == position:
+                        kept.append(node)
+                elif value:
+                    kept.append(node)
+            nodes = kept
+        return nodes
+
+    def eval_expr(self, expr, node, position, size):
+        kind = expr[0]
+        if kind == "literal":
+            return expr[1]
+        if kind == "attr":
+            return node.element.get(expr[1]) if isinstance(node, UiNode) else None
+        if kind == "or":
+            return bool(self.eval_expr(expr[1], node, position, size) or self.eval_expr(expr[2], node, position, size))
+        if kind == "and":
+            return bool(self.eval_expr(expr[1], node, position, size) and self.eval_expr(expr[2], node, position, size))
+        if kind == "compare":
+            left = self.eval_expr(expr[2], node, position, size)
+            right = self.eval_expr(expr[3], node, position, size)
+            if isinstance(left, float) or isinstance(right, float):
+                try:
+                    equal = float(_string_value(left)) == float(_string_value(right))
+                except (TypeError, ValueError):
+                    equal = False
+            else:
+                left, right = _string_value(left), _string_value(right)
+                if left is None or right is None:
+                    return False
+                equal = left == right
+            return equal if expr[1] == "=" else not equal
+        if kind == "call":
+            return self.call(expr[1], expr[2], node, position, size)
+        if kind in ("path", "filter"):
+            return self.eval_location(expr, node)
+        raise XPathUnsupported(f"Unsupported expression {kind}")
+
+    def call(self, name, args, node, position, size):
+        values = [self.eval_expr(arg, node, position, size) for arg in args]
+        if name == "position":
+            return float(position)
+        if name == "last":
+            return float(size)
+        if name == "text":
+            return []  # UiAutomator2's XPath DOM has no text nodes; the label is only in @text
+        if name == "not":
+            return not values[0]
+        strings = [_string_value(v) or "" for v in values]
+        if name == "contains":
+            return strings[1] in strings[0]
+        if name == "starts-with":
+            return strings[0].startswith(strings[1])
+        if name == "normalize-space":
+            return " ".join((strings[0] if strings else "").split())
+        if name == "string-length":
+            return float(len(strings[0] if strings else ""))
+        raise XPathUnsupported(f"Unsupported function {name}()")
+
+
+def evaluate_xpath(tree, expression):
+    """Evaluates an XPath expression against a UiTree; raises XPathUnsupported outside the supported subset."""
+    parsed = _Parser(expression).parse()
+    evaluator = _Evaluator(tree)
+    return evaluator.eval_location(parsed, evaluator.root)
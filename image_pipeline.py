@@ -0,0 +1,175 @@
+"""
+Screenshot processing before the image goes to Gemini.
+
+The raw PNG from get_screenshot_as_png() is full device resolution. The pipeline
+optionally crops the status/navigation bars, downscales to a maximum dimension,
+converts to grayscale and re-encodes as JPEG/WebP/PNG. A difference hash (dHash)
+of each frame lets the agent send a short "screen unchanged" marker instead of an
+image that matches the previous one.
+"""
+import io
+import time
+
+from PIL import Image
+
+from ui_compaction import UiTree, iter_descendants
+
+IMAGE_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+SCREENSHOT_MODES = ("always", "auto", "never")
+
+# dHash grid: HASH_SIZE x HASH_SIZE bits, so small widgets (a toggled switch) still flip bits
+HASH_SIZE = 16
+
+STATUS_BAR_IDS = ("android:id/statusBarBackground",)
+NAVIGATION_BAR_IDS = ("android:id/navigationBarBackground",)
+
+
+def difference_hash(image, hash_size=HASH_SIZE):
+    """Returns a perceptual dHash of a PIL image as an int of hash_size * hash_size bits."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(first, second):
+    return bin(first ^ second).count("1")
+
+
+def system_bar_bounds(ui_tree):
+    """Returns (content_top, content_bottom) in device pixels from the status/navigation bar nodes, if present."""
+    top = bottom = None
+    for node in ui_tree.nodes:
+        if node.bounds is None:
+            continue
+        if node.resource_id in STATUS_BAR_IDS:
+            top = node.bounds[3]
+        elif node.resource_id in NAVIGATION_BAR_IDS and node.bounds[1] > 0:
+            bottom = node.bounds[1]
+    return top, bottom
+
+
+def ui_tree_needs_screenshot(ui_tree):
+    """
+    Decides whether the UI tree alone describes the screen well enough to skip the screenshot.
+    Web content, and interactive elements with no text, content-desc or resource-id anywhere
+    in their subtree (icon-only buttons, custom-drawn views) need visual context.
+    """
+    tree = ui_tree if isinstance(ui_tree, UiTree) else UiTree(ui_tree)
+    informative = 0
+    for node in tree.nodes:
+        if not node.is_visible(tree.screen):
+            continue
+        if "WebView" in node.class_name:
+            return True
+        if node.is_informative:
+            informative += 1
+        if node.is_interactive and not node.flag("scrollable"):
+            labelled = node.is_informative or node.resource_id or any(
+                d.is_informative for d in iter_descendants(node))
+            if not labelled:
+                return True
+    return informative == 0
+
+
+def decode_screenshot(screenshot_binary):
+    """Decodes a PNG screenshot into a loaded PIL image; this part of the pipeline needs no UI tree."""
+    img = Image.open(io.BytesIO(screenshot_binary))
+    img.load()
+    return img
+
+
+class ProcessedScreenshot:
+    """Pipeline output: the Gemini image part (or None when unchanged) plus size and timing."""
+
+    def __init__(self, part, unchanged, original_bytes, encoded_bytes, encode_seconds, phash, size,
+                 crop_top=0, scale=1.0):
+        self.part = part
+        self.unchanged = unchanged
+        self.original_bytes = original_bytes
+        self.encoded_bytes = encoded_bytes
+        self.encode_seconds = encode_seconds
+        self.phash = phash
+        self.size = size
+        self.crop_top = crop_top  # device pixels cropped off the top (status bar)
+        self.scale = scale  # device pixels per pixel of the image Gemini sees
+
+    def to_device(self, x, y):
+        """Maps a point in the image Gemini saw back to device coordinates for a tap."""
+        return int(round(x * self.scale)), int(round(y * self.scale + self.crop_top))
+
+
+class ScreenshotPipeline:
+    """Crops, downscales and re-encodes screenshots, and detects frames identical to the last one."""
+
+    def __init__(self, max_dimension=1024, image_format="JPEG", quality=70, grayscale=False,
+                 crop_system_bars=True, skip_unchanged=True, unchanged_threshold=0):
+        image_format = image_format.upper()
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format '{image_format}'. Expected one of {tuple(IMAGE_FORMATS)}.")
+        self.max_dimension = max_dimension
+        self.image_format = image_format
+        self.quality = quality
+        self.grayscale = grayscale
+        self.crop_system_bars = crop_system_bars
+        self.skip_unchanged = skip_unchanged
+        self.unchanged_threshold = unchanged_threshold
+        self.last_hash = None
+        self.last_part = None  # the most recently encoded image part, for re-sending an unchanged frame
+        self._last_geometry = (0, 1.0)  # (crop_top, scale) of that part
+
+    def reset(self):
+        self.last_hash = None
+        self.last_part = None
+        self._last_geometry = (0, 1.0)
+
+    def process(self, screenshot_binary, ui_tree=None, image=None):
+        """
+        Runs the pipeline on a PNG screenshot; ui_tree (a UiTree) enables system-bar cropping.
+        image is the screenshot already decoded by decode_screenshot(); it may be modified in place.
+        """
+        start = time.perf_counter()
+        img = image if image is not None else decode_screenshot(screenshot_binary)
+
+        crop_top = 0
+        if self.crop_system_bars and ui_tree is not None:
+            top, bottom = system_bar_bounds(ui_tree)
+            top = top or 0
+            bottom = min(bottom or img.height, img.height)
+            if 0 <= top < bottom and (top, bottom) != (0, img.height):
+                img = img.crop((0, top, img.width, bottom))
+                crop_top = top
+
+        phash = difference_hash(img)
+        unchanged = (self.skip_unchanged and self.last_hash is not None
+                     and hamming_distance(phash, self.last_hash) <= self.unchanged_threshold)
+        self.last_hash = phash
+        if unchanged:
+            # Gemini sees the previous frame again (or remembers it), so its geometry applies
+            return ProcessedScreenshot(None, True, len(screenshot_binary), 0, time.perf_counter() - start,
+                                       phash, img.size, *self._last_geometry)
+
+        cropped_width = img.width
+        if self.max_dimension and max(img.size) > self.max_dimension:
+            img.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+        scale = cropped_width / img.width
+        if self.grayscale:
+            img = img.convert("L")
+        elif self.image_format == "JPEG" or img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        buffer = io.BytesIO()
+        if self.image_format == "PNG":
+            img.save(buffer, format="PNG", optimize=True)
+        else:
+            img.save(buffer, format=self.image_format, quality=self.quality)
+        data = buffer.getvalue()
+        part = {"mime_type": IMAGE_FORMATS[self.image_format], "data": data}
+        self.last_part = part
+        self._last_geometry = (crop_top, scale)
+        return ProcessedScreenshot(part, False, len(screenshot_binary), len(data),
+                                   time.perf_counter() - start, phash, img.size, crop_top, scale)
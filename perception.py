@@ -0,0 +1,160 @@
+"""
+Concurrent, pipelined perception for the agent loop.
+
+Each turn needs page_source and, usually, a screenshot: two independent Appium
+round-trips that used to run back to back. ScreenCapture issues them on two
+worker threads, so they travel over separate pooled HTTP connections, and
+decodes the PNG on the screenshot thread while the XML is still arriving.
+After an action has settled, prefetch() starts capturing the next screen in
+the background (reusing the settle poll's page_source when it has one) while
+the turn's bookkeeping runs, and the next capture() picks the result up.
+
+Every capture records how long the loop was actually blocked next to how long
+the same captures would have taken one after the other, so summary() can
+report the perception latency saved per turn.
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import tracing
+from image_pipeline import decode_screenshot
+
+
+def _completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class Perception:
+    """One turn's captured screen: the XML now, the screenshot on demand."""
+
+    def __init__(self, ui_tree_xml, xml_seconds, screenshot_future=None, prefetched=False):
+        self.ui_tree_xml = ui_tree_xml
+        self.prefetched = prefetched
+        self.screenshot_future = screenshot_future  # resolves to (png, decoded image or None, seconds)
+        self.sequential_seconds = xml_seconds  # what the same captures cost back to back
+        self.blocked_seconds = 0.0  # what the loop actually waited
+        self.screenshot_used = False
+
+    @property
+    def saved_seconds(self):
+        return self.sequential_seconds - self.blocked_seconds
+
+
+class ScreenCapture:
+    """Captures page_source and screenshots for one driver, concurrently when `concurrent` is set."""
+
+    def __init__(self, driver, concurrent=True, decode=True, prefetch=True):
+        self.driver = driver
+        self.concurrent = concurrent
+        self.decode = decode
+        self.prefetch_enabled = prefetch
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="perception") if concurrent else None
+        self._pending = None  # (xml future, screenshot future or None) captured ahead of the next turn
+        self.samples = []  # one Perception per turn
+        self.wasted_screenshots = 0  # speculative screenshots the turn turned out not to need
+        self._last_xml_seconds = 0.0  # latest page_source round-trip, the cost of an XML reused from settle
+
+    def _fetch_page_source(self, parent=None):
+        start = time.perf_counter()
+        with tracing.span("page_source", parent=parent) as span:
+            ui_tree_xml = self.driver.page_source
+            span.set(bytes=len(ui_tree_xml))
+        self._last_xml_seconds = time.perf_counter() - start
+        return ui_tree_xml, self._last_xml_seconds
+
+    def _fetch_screenshot(self, parent=None):
+        start = time.perf_counter()
+        with tracing.span("capture_screenshot", parent=parent) as span:
+            screenshot_binary = self.driver.get_screenshot_as_png()
+            span.set(bytes=len(screenshot_binary))
+        # Decoding needs no UI tree, so it overlaps with the page_source download
+        image = decode_screenshot(screenshot_binary) if self.decode else None
+        return screenshot_binary, image, time.perf_counter() - start
+
+    def _submit(self, func):
+        if not self._pool:
+            return _completed(func())
+        # Worker threads have no span stack of their own; nest their spans under the caller's
+        return self._pool.submit(func, tracing.current_span())
+
+    def prefetch(self, want_screenshot, ui_tree_xml=None):
+        """
+        Starts capturing the next screen right after an action has settled. ui_tree_xml is the settled
+        page_source when the caller already has it. Only call this when nothing else will act on the
+        device before the next capture().
+        """
+        self.discard()
+        if not self.prefetch_enabled:
+            return
+        if ui_tree_xml is not None:
+            xml_future = _completed((ui_tree_xml, self._last_xml_seconds))
+        elif self._pool:
+            xml_future = self._submit(self._fetch_page_source)
+        else:
+            return  # Sequential mode only reuses an XML it is handed
+        screenshot_future = self._submit(self._fetch_screenshot) if want_screenshot and self._pool else None
+        self._pending = (xml_future, screenshot_future)
+
+    def discard(self):
+        """Drops a prefetched capture (e.g. the screen was acted on after it was taken)."""
+        if self._pending and self._pending[1] is not None:
+            self.wasted_screenshots += 1
+        self._pending = None
+
+    def capture(self, want_screenshot):
+        """
+        Returns this turn's Perception. With want_screenshot the screenshot is captured alongside the XML;
+        otherwise screenshot() fetches it later only if the turn turns out to need it.
+        """
+        start = time.perf_counter()
+        pending, self._pending = self._pending, None
+        if pending:
+            xml_future, screenshot_future = pending
+            if screenshot_future is None and want_screenshot:
+                screenshot_future = self._submit(self._fetch_screenshot)
+        else:
+            screenshot_future = self._submit(self._fetch_screenshot) if want_screenshot and self._pool else None
+            xml_future = self._submit(self._fetch_page_source)
+        ui_tree_xml, xml_seconds = xml_future.result()
+        perception = Perception(ui_tree_xml, xml_seconds, screenshot_future, prefetched=pending is not None)
+        perception.blocked_seconds = time.perf_counter() - start
+        self.samples.append(perception)
+        return perception
+
+    def screenshot(self, perception):
+        """Returns (png bytes, decoded image or None) for the turn, waiting for or taking the capture."""
+        start = time.perf_counter()
+        future = perception.screenshot_future or self._submit(self._fetch_screenshot)
+        perception.screenshot_future = future
+        screenshot_binary, image, seconds = future.result()
+        perception.blocked_seconds += time.perf_counter() - start
+        perception.sequential_seconds += seconds
+        perception.screenshot_used = True
+        return screenshot_binary, image
+
+    def finish(self, perception):
+        """Accounts for a speculative screenshot the turn did not use."""
+        if perception.screenshot_future is not None and not perception.screenshot_used:
+            self.wasted_screenshots += 1
+            perception.screenshot_future = None
+
+    def close(self):
+        self.discard()
+        if self._pool:
+            self._pool.shutdown(wait=False)
+
+    def summary(self):
+        """Perception latency per turn: blocked vs. back-to-back captures, and how much that saved."""
+        if not self.samples:
+            return "[Perception]: No screens captured."
+        turns = len(self.samples)
+        blocked = sum(p.blocked_seconds for p in self.samples)
+        sequential = sum(p.sequential_seconds for p in self.samples)
+        prefetched = sum(1 for p in self.samples if p.prefetched)
+        mode = "concurrent" if self.concurrent else "sequential"
+        return (f"[Perception]: {turns} turns ({mode}), waited {blocked / turns * 1000:.0f} ms/turn vs. "
+                f"{sequential / turns * 1000:.0f} ms/turn capturing back to back "
+                f"(saved {(sequential - blocked) / turns * 1000:.0f} ms/turn, {sequential - blocked:.2f}s total); "
+                f"{prefetched} screens prefetched after settle, {self.wasted_screenshots} speculative screenshots unused.")
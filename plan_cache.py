@@ -0,0 +1,178 @@
+"""
+Persistent plan cache: (goal, screen fingerprint) -> action that worked last time.
+
+Regression suites replay the same goals over the same screens, so once an action
+has led to a successful step it can be reused without a Gemini round-trip. New
+entries are staged during a run and only committed once the goal is achieved, so
+a run that fails or loops cannot poison the cache. Entries are evicted by TTL and
+least-recent use, and an entry whose action fails on replay is invalidated. The
+on-disk JSON store is read-merge-written under an exclusive file lock and
+replaced atomically, so concurrent runs can share one cache file.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_PLAN_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ai-app-automation", "plan_cache.json")
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+# Actions worth caching; failures, errors and GOAL_IMPOSSIBLE never are
+CACHEABLE_ACTIONS = ("click", "type", "scroll", "scroll_to", "press_keycode", "launch_app", "terminate_app", "GOAL_ACHIEVED")
+
+
+def plan_cache_key(goal_text, fingerprint):
+    normalized_goal = " ".join(goal_text.split())
+    return hashlib.sha1(f"{normalized_goal}|{fingerprint}".encode("utf-8")).hexdigest()
+
+
+class _FileLock:
+    """Exclusive inter-process lock on a sidecar .lock file."""
+
+    def __init__(self, path):
+        self.path = path + ".lock"
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, "a+")
+        if fcntl:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+        else:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        else:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        self.handle.close()
+
+
+class PlanCache:
+    """LRU/TTL cache of successful actions, keyed by goal and screen fingerprint."""
+
+    def __init__(self, path=DEFAULT_PLAN_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}
+        self._pending = {}  # key -> entry to upsert, or None to delete, on the next flush
+        self._staged = {}  # key -> entry from this run, committed only once the goal is achieved
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with _FileLock(path):
+                self.entries = self._read()
+            self._evict(self.entries)
+
+    def get(self, goal_text, fingerprint):
+        """Returns the cached action for this goal on this screen, or None."""
+        key = plan_cache_key(goal_text, fingerprint)
+        entry = self.entries.get(key)
+        if entry and time.time() - entry["stored_at"] > self.ttl_seconds:
+            self.entries.pop(key)
+            self._pending[key] = None
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["last_used"] = time.time()
+        entry["uses"] += 1
+        self._pending[key] = entry
+        return dict(entry["action"])
+
+    def put(self, goal_text, fingerprint, action):
+        """Stages the action that just led to a successful step on this screen; see commit()."""
+        if action.get("action") not in CACHEABLE_ACTIONS:
+            return
+        key = plan_cache_key(goal_text, fingerprint)
+        now = time.time()
+        self._staged[key] = {"action": action, "fingerprint": fingerprint, "stored_at": now, "last_used": now,
+                             "uses": 0}
+
+    def commit(self):
+        """Stores the actions staged by put() once the goal they belong to has been achieved."""
+        for key, entry in self._staged.items():
+            self.entries[key] = entry
+            self._pending[key] = entry
+        self._staged = {}
+        self._evict(self.entries)
+        self.flush()
+
+    def invalidate(self, goal_text, fingerprint):
+        """Drops the entry for this goal and screen, e.g. after its cached action failed."""
+        key = plan_cache_key(goal_text, fingerprint)
+        self._staged.pop(key, None)
+        if self.entries.pop(key, None) is not None:
+            self.invalidations += 1
+            print(f"[Plan Cache]: Invalidated cached action for screen {fingerprint}.")
+        self._pending[key] = None
+        self.flush()
+
+    def flush(self):
+        """Merges pending changes into the on-disk store under the file lock."""
+        if not self.path or not self._pending:
+            return
+        with _FileLock(self.path):
+            stored = self._read()
+            for key, entry in self._pending.items():
+                if entry is None:
+                    stored.pop(key, None)
+                else:
+                    stored[key] = entry
+            self._evict(stored)
+            self._write(stored)
+        self._pending = {}
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats_summary(self):
+        return (f"[Plan Cache]: {self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), "
+                f"{self.invalidations} invalidations, {len(self.entries)} entries.")
+
+    def _evict(self, entries):
+        now = time.time()
+        for key in [k for k, e in entries.items() if now - e["stored_at"] > self.ttl_seconds]:
+            del entries[key]
+        if len(entries) > self.max_entries:
+            by_last_use = sorted(entries, key=lambda k: entries[k]["last_used"])
+            for key in by_last_use[:len(entries) - self.max_entries]:
+                del entries[key]
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[Plan Cache WARNING]: Ignoring unreadable cache file {self.path}: {e}")
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".plan_cache.", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
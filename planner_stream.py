@@ -0,0 +1,301 @@
+"""
+Streaming and robust parsing of GeminiAgent's planner responses.
+
+With streaming, the response is consumed chunk by chunk and the first complete
+JSON action is taken as soon as its braces balance; the rest of the generation
+(a closing fence, trailing commentary) is cancelled. Gemini can also be asked
+for structured output against a schema of the allowed action types, so the
+reply is bare JSON. Whatever arrives is parsed through a fast path (bare JSON,
+then a ```json fence, then a scan for the first balanced object) and, if that
+fails, a cheap local repair (trailing commas, Python literals, single quotes,
+unclosed brackets) before the caller spends another model call on it.
+PlannerStats records time-to-action and how often each of those paths was needed.
+"""
+import json
+import re
+
+from tracing import percentile
+
+ACTION_TYPES = ("click", "type", "scroll", "scroll_to", "press_keycode", "launch_app", "terminate_app",
+                "GOAL_ACHIEVED", "GOAL_IMPOSSIBLE")
+LOCATOR_STRATEGIES = ("HANDLE", "ID", "ACCESSIBILITY_ID", "XPATH", "CLASS_NAME", "COORDINATES")
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*([\{\[].*?[\}\]])\s*```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([\}\]])")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PYTHON_LITERAL_RE = re.compile(r"\b(True|False|None)\b")
+
+PARSE_RETRY_PROMPT = ("Your previous reply could not be parsed as a JSON action. Reply again with only the JSON "
+                      "object for the same action, with no text before or after it.")
+
+
+def _step_schema(with_expect):
+    properties = {
+        "thought": {"type": "string"},
+        "action": {"type": "string", "enum": list(ACTION_TYPES)},
+        "by": {"type": "string", "enum": list(LOCATOR_STRATEGIES)},
+        "value": {"type": "string", "description": "Locator value; 'x,y' for COORDINATES"},
+        "text": {"type": "string"},
+        "desc": {"type": "string"},
+        "id": {"type": "string"},
+        "direction": {"type": "string", "enum": ["up", "down", "left", "right"]},
+        "key_code": {"type": "integer"},
+        "package": {"type": "string"},
+        "activity": {"type": "string"},
+    }
+    if with_expect:
+        properties["expect"] = {"type": "object", "properties": {
+            "by": {"type": "string", "enum": list(LOCATOR_STRATEGIES)},
+            "value": {"type": "string"},
+            "text": {"type": "string"},
+            "checked": {"type": "boolean"},
+            "present": {"type": "boolean"},
+        }}
+    return {"type": "object", "properties": properties}
+
+
+def action_response_schema(batched=False):
+    """Response schema for Gemini's structured output: one action, or (batched) an optional plan of actions."""
+    schema = _step_schema(with_expect=False)
+    if not batched:
+        schema["required"] = ["action"]
+        return schema
+    schema["properties"]["plan"] = {"type": "array", "items": _step_schema(with_expect=True)}
+    return schema
+
+
+def looks_like_action(value):
+    """True for a parsed action, a {"plan": [...]} object or a list of actions."""
+    if isinstance(value, dict):
+        return "action" in value or isinstance(value.get("plan"), list)
+    if isinstance(value, list):
+        return bool(value) and all(isinstance(step, dict) and "action" in step for step in value)
+    return False
+
+
+class JsonScanner:
+    """
+    Finds the first balanced JSON object or array that parses to an action, in text fed incrementally.
+    Candidates in prose that don't parse (or aren't actions) are skipped, and once a ```json fence
+    opens, scanning restarts inside it.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._fence_seen = False
+
+    def _reset_candidate(self, resume_at):
+        self._start = None
+        self._stack = []
+        self._in_string = self._escaped = False
+        self._pos = resume_at
+
+    def feed(self, text):
+        """Adds text; returns (value, json_text) for the first complete action, or None if there is none yet."""
+        self.buffer += text
+        if not self._fence_seen:
+            fence = self.buffer.find("```")
+            if fence >= 0:
+                self._fence_seen = True
+                if (self._start is not None and self._start < fence) or self._pos < fence:
+                    self._reset_candidate(fence + 3)
+        buffer = self.buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._start is None:
+                if char in "{[":
+                    self._start = i
+                    self._stack = ["}" if char == "{" else "]"]
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append("}" if char == "{" else "]")
+            elif char in "}]":
+                if char != self._stack[-1]:
+                    start = self._start
+                    self._reset_candidate(start + 1)
+                    i = start + 1
+                    continue
+                self._stack.pop()
+                if not self._stack:
+                    start = self._start
+                    candidate = buffer[start:i + 1]
+                    try:
+                        value = json.loads(candidate)
+                    except ValueError:
+                        value = None
+                    if looks_like_action(value):
+                        self._reset_candidate(i + 1)
+                        return value, candidate
+                    self._reset_candidate(start + 1)
+                    i = start + 1
+                    continue
+            i += 1
+        self._pos = i
+        return None
+
+
+def repair_json(text):
+    """Best-effort local fix of almost-JSON from the model; returns the parsed action or None."""
+    fence = _FENCE_RE.search(text)
+    candidate = fence.group(1) if fence else text
+    starts = [index for index in (candidate.find("{"), candidate.find("[")) if index >= 0]
+    if not starts:
+        return None
+    candidate = candidate[min(starts):].strip().rstrip("`").strip()
+    candidate = candidate.replace("“", '"').replace("”", '"')
+    if '"' not in candidate:
+        candidate = candidate.replace("'", '"')
+    candidate = _PYTHON_LITERAL_RE.sub(lambda m: _PYTHON_LITERALS[m.group(1)], candidate)
+    candidate = _TRAILING_COMMA_RE.sub(r"\1", candidate)
+    candidate = _close_brackets(candidate)
+    found = JsonScanner().feed(candidate)
+    if found is not None:
+        return found[0]
+    try:
+        value = json.loads(candidate)
+    except ValueError:
+        return None
+    return value if looks_like_action(value) else None
+
+
+def _close_brackets(text):
+    """Closes strings, objects and arrays left open by a truncated response."""
+    stack = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack and stack[-1] == char:
+            stack.pop()
+    if not stack and not in_string:
+        return text
+    text = (text + '"') if in_string else text
+    return _TRAILING_COMMA_RE.sub(r"\1", text.rstrip().rstrip(",") + "".join(reversed(stack)))
+
+
+def parse_action_text(text):
+    """
+    Parses a complete planner response. Returns (value, method), method being 'direct', 'fenced',
+    'scanned' or 'repaired'; raises json.JSONDecodeError if even the repair fails.
+    """
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            value = json.loads(stripped)
+            if looks_like_action(value):
+                return value, "direct"
+        except ValueError:
+            pass
+    fence = _FENCE_RE.search(stripped)
+    if fence:
+        try:
+            value = json.loads(fence.group(1))
+            if looks_like_action(value):
+                return value, "fenced"
+        except ValueError:
+            pass
+    found = JsonScanner().feed(stripped)
+    if found is not None:
+        return found[0], "scanned"
+    value = repair_json(stripped)
+    if value is not None:
+        return value, "repaired"
+    raise json.JSONDecodeError("No parseable JSON action in the response", text, 0)
+
+
+def _chunk_text(chunk):
+    try:
+        return chunk.text or ""
+    except ValueError:  # A chunk without text parts (e.g. only safety ratings or usage metadata)
+        return ""
+
+
+def cancel_stream(response):
+    """Stops the rest of a streamed generation; the SDK has no public cancel, so close the underlying call."""
+    iterator = getattr(response, "_iterator", None)
+    for name in ("cancel", "close"):
+        method = getattr(iterator, name, None)
+        if callable(method):
+            try:
+                method()
+            except Exception as e:
+                print(f"[Planner WARNING]: Could not cancel the response stream: {e}")
+            return True
+    return False
+
+
+def read_first_action(response):
+    """
+    Consumes a streamed response until the first complete JSON action, then cancels the rest.
+    Returns (text received, parsed value or None, stopped_early).
+    """
+    scanner = JsonScanner()
+    for chunk in response:
+        found = scanner.feed(_chunk_text(chunk))
+        if found is not None:
+            cancel_stream(response)
+            return scanner.buffer, found[0], True
+    return scanner.buffer, None, False
+
+
+class PlannerStats:
+    """Time-to-action and parse outcomes of the planner's model calls."""
+
+    def __init__(self):
+        self.time_to_action = []  # seconds from sending the request to having a parsed action, per planner call
+        self.methods = {}  # parse path -> responses ('streamed', 'direct', 'fenced', 'scanned', 'repaired')
+        self.stopped_early = 0
+        self.responses = 0  # model replies, including retries
+        self.unparseable = 0  # replies that could not be parsed even after local repair
+        self.retries = 0  # extra model calls spent on unparseable replies
+        self.failures = 0  # planner calls left without an action after all retries
+
+    def record_response(self, method):
+        """Counts one model reply and how it was parsed (method None: unparseable after repair)."""
+        self.responses += 1
+        if method:
+            self.methods[method] = self.methods.get(method, 0) + 1
+        else:
+            self.unparseable += 1
+
+    def record(self, seconds, parsed, stopped_early=False, retries=0):
+        """Counts one planner call, after its replies have been recorded."""
+        self.time_to_action.append(seconds)
+        self.stopped_early += 1 if stopped_early else 0
+        self.retries += retries
+        self.failures += 0 if parsed else 1
+
+    def summary(self):
+        if not self.time_to_action:
+            return "[Planner]: No model calls."
+        calls = len(self.time_to_action)
+        repaired = self.methods.get("repaired", 0)
+        methods = ", ".join(f"{k} {v}" for k, v in sorted(self.methods.items())) or "none"
+        return (f"[Planner]: {calls} calls, time to action p50 {percentile(self.time_to_action, 0.5):.2f}s / "
+                f"p95 {percentile(self.time_to_action, 0.95):.2f}s, {self.stopped_early} taken mid-stream; "
+                f"{self.responses} replies (parsed: {methods}); parse failures {repaired + self.unparseable}/"
+                f"{self.responses} ({(repaired + self.unparseable) / self.responses:.0%}), {repaired} repaired locally, "
+                f"{self.retries} retry calls, {self.failures} calls without an action.")
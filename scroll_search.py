@@ -0,0 +1,144 @@
+"""
+Local scroll-until-found for the `scroll_to` action.
+
+Instead of asking Gemini after every scroll whether the target is visible yet,
+AppiumExecutor scrolls with `mobile: scrollGesture` and re-checks the parsed UI
+tree itself until an element matching the target predicate (text, content-desc
+and/or resource-id) is visible. The end of the list is detected when a scroll
+no longer changes the visible text and bounds (or scrollGesture reports it
+cannot scroll further), and the number of scrolls is bounded. The planner gets a
+single outcome for the whole search.
+"""
+import hashlib
+import time
+
+from ui_compaction import UiTree
+
+DEFAULT_MAX_SCROLLS = 10
+DEFAULT_SCROLL_PERCENT = 0.8
+SCROLL_DIRECTIONS = ("up", "down", "left", "right")
+
+# Accepted spellings of the predicate keys in a scroll_to action
+_TARGET_KEYS = {
+    "text": "text",
+    "desc": "content_desc", "content_desc": "content_desc", "content-desc": "content_desc",
+    "id": "resource_id", "resource_id": "resource_id", "resource-id": "resource_id",
+}
+
+FOUND = "found"
+END_OF_LIST = "end_of_list"
+MAX_SCROLLS = "max_scrolls"
+
+
+def parse_target(action):
+    """Extracts the target predicate ({text, content_desc, resource_id}) from a scroll_to action."""
+    target = {}
+    for key, name in _TARGET_KEYS.items():
+        value = action.get(key)
+        if isinstance(value, str) and value.strip():
+            target[name] = value.strip()
+    if not target:
+        raise ValueError("scroll_to needs at least one of 'text', 'desc' or 'id'")
+    return target
+
+
+def describe_target(target):
+    return ", ".join(f"{name}='{value}'" for name, value in target.items())
+
+
+def _matches(node, target, exact):
+    for name, value in target.items():
+        if name == "resource_id":
+            if node.resource_id != value and not node.resource_id.endswith("/" + value):
+                return False
+            continue
+        actual = (node.identity_text if name == "text" else node.content_desc).casefold()
+        if not (actual == value.casefold() if exact else value.casefold() in actual):
+            return False
+    return True
+
+
+def find_target(tree, target, exact=True):
+    """Visible nodes whose text/content-desc equals the target's (case-insensitive), or contains it if not exact."""
+    return [node for node in tree.nodes
+            if node.bounds and node.is_visible(tree.screen) and _matches(node, target, exact)]
+
+
+def visible_content_digest(tree):
+    """
+    Hash of the raw text, content-desc and bounds of every visible node: whether a gesture moved anything.
+    Unlike screen_fingerprint, which masks volatile text for caching, rows that differ only by numbers differ here.
+    """
+    digest = hashlib.sha1()
+    for node in tree.nodes:
+        if node.bounds and node.is_visible(tree.screen):
+            digest.update(f"{node.text}|{node.content_desc}|{node.bounds}\n".encode("utf-8"))
+    return digest.digest()
+
+
+def scroll_area(tree):
+    """Gesture area of the largest visible scrollable container, or None if the screen has none."""
+    containers = [node for node in tree.nodes if node.flag("scrollable") and node.bounds
+                  and node.is_visible(tree.screen) and node.bounds[2] > node.bounds[0] and node.bounds[3] > node.bounds[1]]
+    if not containers:
+        return None
+    x1, y1, x2, y2 = max(containers, key=lambda n: (n.bounds[2] - n.bounds[0]) * (n.bounds[3] - n.bounds[1])).bounds
+    return {"left": x1, "top": y1, "width": x2 - x1, "height": y2 - y1}
+
+
+def window_scroll_area(window_size):
+    """The middle 80% of the window, as the plain scroll action uses."""
+    return {"left": window_size["width"] * 0.1, "top": window_size["height"] * 0.1,
+            "width": window_size["width"] * 0.8, "height": window_size["height"] * 0.8}
+
+
+class ScrollSearchResult:
+    """Outcome of one scroll_to search."""
+
+    def __init__(self, status, scrolls, node=None, ui_tree_xml=None, seconds=0.0, partial_node=None):
+        self.status = status  # FOUND, END_OF_LIST or MAX_SCROLLS
+        self.scrolls = scrolls
+        self.node = node
+        self.partial_node = partial_node  # visible element only containing the target text, when nothing matched exactly
+        self.ui_tree_xml = ui_tree_xml  # page_source of the screen the search stopped on
+        self.seconds = seconds
+
+    @property
+    def found(self):
+        return self.status == FOUND
+
+
+def scroll_until_found(driver, target, direction="down", max_scrolls=DEFAULT_MAX_SCROLLS,
+                       percent=DEFAULT_SCROLL_PERCENT, settle=None, ui_tree_xml=None):
+    """
+    Scrolls in `direction` until an element exactly matching `target` is visible, the list stops
+    moving, or max_scrolls is reached; only then is a partial (substring) match reported. settle() is called after each gesture and may return the settled
+    page_source to save a round-trip; ui_tree_xml is the already captured current screen, if any.
+    """
+    if direction not in SCROLL_DIRECTIONS:
+        raise ValueError(f"Unknown scroll direction '{direction}'. Expected one of {SCROLL_DIRECTIONS}.")
+    start = time.perf_counter()
+    ui_tree_xml = ui_tree_xml or driver.page_source
+    can_scroll_more = True
+    scrolls = 0
+    while True:
+        tree = UiTree(ui_tree_xml)
+        matches = find_target(tree, target)
+        if matches:
+            return ScrollSearchResult(FOUND, scrolls, matches[0], ui_tree_xml, time.perf_counter() - start)
+        if not can_scroll_more or scrolls >= max_scrolls:
+            partial = find_target(tree, target, exact=False)
+            return ScrollSearchResult(END_OF_LIST if not can_scroll_more else MAX_SCROLLS, scrolls,
+                                      ui_tree_xml=ui_tree_xml, seconds=time.perf_counter() - start,
+                                      partial_node=partial[0] if partial else None)
+
+        area = scroll_area(tree) or window_scroll_area(driver.get_window_size())
+        before = visible_content_digest(tree)
+        # scrollGesture returns False once the container cannot scroll any further in this direction
+        can_scroll_more = driver.execute_script("mobile: scrollGesture",
+                                                dict(area, direction=direction, percent=percent)) is not False
+        scrolls += 1
+        settled_source = settle() if settle else None
+        ui_tree_xml = settled_source if isinstance(settled_source, str) else driver.page_source
+        if visible_content_digest(UiTree(ui_tree_xml)) == before:
+            can_scroll_more = False  # The gesture moved nothing: already at the end of the list
@@ -1,9 +1,9 @@
 import time
 import os
 import json
-import io
 import re
-from PIL import Image
+import argparse
+import contextlib
 
 # Appium Imports
 from appium import webdriver
@@ -12,10 +12,31 @@ from appium.webdriver.common.appiumby import AppiumBy
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+try:
+    from appium.webdriver.client_config import AppiumClientConfig
+except ImportError: # Appium-Python-Client < 4.3 has no client config; the default HTTP pool is used
+    AppiumClientConfig = None
 from dotenv import load_dotenv 
 
 # Google Gemini Imports
 import google.generativeai as genai
+from google.api_core.exceptions import InvalidArgument
+
+# Local helpers
+from ui_compaction import DEFAULT_UI_TREE_BUDGET, compact_ui_tree, screen_fingerprint
+from conversation_memory import DEFAULT_MEMORY_MODE, DEFAULT_WINDOW_TURNS, ConversationMemory, part_bytes
+from plan_cache import DEFAULT_PLAN_CACHE_PATH, PlanCache
+from ui_settle import UiSettleWaiter
+from image_pipeline import ScreenshotPipeline, ui_tree_needs_screenshot
+from element_index import MISSING, ElementIndex
+from device_pool import DEFAULT_MAX_CONCURRENT_MODEL_CALLS, DEFAULT_MODEL_CALLS_PER_MINUTE, DevicePool, ModelRateLimiter
+from session_manager import SessionManager, reset_app
+from action_plan import DEFAULT_MAX_PLAN_STEPS, PLAN_MODES, check_postcondition, plan_steps
+from perception import ScreenCapture
+from planner_stream import PARSE_RETRY_PROMPT, PlannerStats, action_response_schema, parse_action_text, read_first_action
+from scroll_search import DEFAULT_MAX_SCROLLS, describe_target, parse_target, scroll_until_found
+import tracing
+from trajectory import Trajectory, TrajectoryRecorder, replay_summary, replay_trajectory, trajectory_path
 
 # Load environment variables (e.g., GOOGLE_API_KEY)
 load_dotenv() 
@@ -31,7 +52,7 @@ API_DEMOS_PACKAGE = 'io.appium.android.apis'
 API_DEMOS_ACTIVITY = 'io.appium.android.apis.ApiDemos'
 
 # You might need to update these for your specific emulator/device
-DEVICE_NAME = 'emulator-5554' # e.g., 'Pixel_4_API_30'
+DEVICE_NAME = os.getenv("DEVICE_NAME", 'emulator-5554') # e.g., 'Pixel_4_API_30'
 PLATFORM_VERSION = '15'       # e.g., '30' for Android 11, '15' for Android 4.0.3
 
 # Initial capabilities to launch ApiDemos
@@ -46,122 +67,386 @@ capabilities = {
     'appium:noReset': True # Keep app data between sessions
 }
 
-# Global driver and wait objects (will be initialized in run_agentic_automation_with_gemini)
-driver = None
-wait = None
+
+def capabilities_for_device(udid, system_port=None, **overrides):
+    """Capabilities for one device of a pool; parallel UiAutomator2 sessions need distinct systemPorts."""
+    device_capabilities = dict(capabilities, **{'appium:deviceName': udid, 'appium:udid': udid})
+    if system_port:
+        device_capabilities['appium:systemPort'] = system_port
+    device_capabilities.update(overrides)
+    return device_capabilities
+
+
+# Size budget (bytes) for the compacted UI tree sent to Gemini each turn
+UI_TREE_BUDGET_BYTES = DEFAULT_UI_TREE_BUDGET
+
+# Conversation memory: "full" (legacy, re-sends everything), "window" or "digest"
+MEMORY_MODE = DEFAULT_MEMORY_MODE
+MEMORY_WINDOW_TURNS = DEFAULT_WINDOW_TURNS
+
+# Plan cache: reuse the action that worked last time for the same goal on the same screen
+PLAN_CACHE_ENABLED = True
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", DEFAULT_PLAN_CACHE_PATH)
+
+# Screenshots: "always" sends one every turn, "auto" only when the UI tree alone is not enough
+# (web content, unlabeled icons) or after a failed action, "never" runs text-only
+SCREENSHOT_MODE = "always"
+IMAGE_PIPELINE_SETTINGS = {
+    'max_dimension': 1024,      # Longest side in pixels after downscaling
+    'image_format': 'JPEG',     # JPEG, WEBP or PNG
+    'quality': 70,              # JPEG/WebP quality
+    'grayscale': False,
+    'crop_system_bars': True,   # Crop status/navigation bars using their UI tree bounds
+    'skip_unchanged': True,     # Send a "screen unchanged" marker instead of a repeated frame
+}
+
+# Perception: capture page_source and the screenshot concurrently (the PNG is decoded while the XML is
+# still arriving), and start capturing the next screen as soon as an action has settled
+PERCEPTION_SETTINGS = {
+    'concurrent': True,
+    'decode': True,             # Decode the screenshot on the capture thread, ahead of the image pipeline
+    'prefetch': True,           # Capture the next screen while the turn's bookkeeping runs
+}
+# HTTP connections kept open per Appium session, so concurrent captures don't queue on one socket
+APPIUM_HTTP_POOL_SIZE = 4
+
+# Planning: "single" asks Gemini for one action per turn; "batched" lets it return a short plan whose
+# steps carry postconditions, checked locally so Gemini is only called again when one fails
+PLAN_MODE = "single"
+MAX_PLAN_STEPS = DEFAULT_MAX_PLAN_STEPS
+
+# Planner responses: stream them and act on the first complete JSON action, ask for structured JSON output
+# against the action schema (falls back to free-form if the model rejects it), and how many extra calls
+# an unparseable response may cost after the local repair step has failed
+PLANNER_STREAMING = True
+PLANNER_STRUCTURED_OUTPUT = True
+PLANNER_PARSE_RETRIES = 1
+
+# Optional directory where every achieved goal is saved as a trajectory for LLM-free replay (--replay)
+TRAJECTORY_DIR = os.getenv("TRAJECTORY_DIR")
+
+# Tracing: per-phase timing spans (page_source, model_call, settle, ...) with a p50/p95 summary per run.
+# TRACE_PATH also writes every span as JSONL; with neither set, spans are no-ops
+TRACE_PATH = os.getenv("TRACE_PATH")
+TRACING_ENABLED = bool(TRACE_PATH) or os.getenv("TRACING") == "1"
+
+# Tap an element's bounds center directly when the local element index resolves its locator
+# unambiguously, skipping the server-side element lookup
+DIRECT_TAP_RESOLVED_ELEMENTS = False
+
+# Upper bound on gestures for one scroll_to search (the executor scrolls locally until the target is visible)
+SCROLL_TO_MAX_SCROLLS = DEFAULT_MAX_SCROLLS
+
+# Optional JSONL file that collects post-action settle times for tuning the settle budgets
+SETTLE_LOG_PATH = os.getenv("SETTLE_LOG_PATH")
+
+# Global limits on Gemini calls when several goals run in parallel
+MAX_CONCURRENT_MODEL_CALLS = DEFAULT_MAX_CONCURRENT_MODEL_CALLS
+MODEL_CALLS_PER_MINUTE = DEFAULT_MODEL_CALLS_PER_MINUTE
 
 # --- Gemini Agent: The Cognitive Core ---
 # ... (rest of the code) ...
 
 class GeminiAgent:
-    def __init__(self, model_name="gemini-1.5-flash"):
-        self.model = genai.GenerativeModel(model_name=model_name)
-        self.chat_history = [] 
+    def __init__(self, model_name="gemini-1.5-flash", ui_tree_budget=UI_TREE_BUDGET_BYTES,
+                 memory_mode=MEMORY_MODE, memory_window_turns=MEMORY_WINDOW_TURNS, image_pipeline=None,
+                 rate_limiter=None, plan_mode=PLAN_MODE, model=None, streaming=PLANNER_STREAMING,
+                 structured_output=PLANNER_STRUCTURED_OUTPUT):
+        if plan_mode not in PLAN_MODES:
+            raise ValueError(f"Unknown plan mode '{plan_mode}'. Expected one of {PLAN_MODES}.")
+        self.plan_mode = plan_mode
+        self.memory = ConversationMemory(mode=memory_mode, window_turns=memory_window_turns)
+        self.rate_limiter = rate_limiter or contextlib.nullcontext() # Shared ModelRateLimiter when running in a pool
+        self.image_pipeline = image_pipeline or ScreenshotPipeline(**IMAGE_PIPELINE_SETTINGS)
+        self.ui_tree_budget = ui_tree_budget
+        self.last_compact_tree = None # CompactTree from the latest turn, used to resolve handles
+        self.last_screenshot = None # ProcessedScreenshot Gemini last saw, used to map COORDINATES to the device
+        self.streaming = streaming
+        self.generation_config = ({"response_mime_type": "application/json",
+                                   "response_schema": action_response_schema(batched=plan_mode == "batched")}
+                                  if structured_output else None)
+        self.planner_stats = PlannerStats()
 
         self.system_instruction = (
             "You are an AI agent controlling an Android mobile device via Appium. "
             "Your objective is to achieve the user's high-level goals by interacting with the UI. "
             "For each turn, you will receive:\n"
             "1.  The overall **User Goal** (this is the persistent goal).\n"
-            "2.  A **Screenshot** of the current mobile screen.\n"
-            "3.  The **UI Tree (XML structure)**, which provides precise details like resource-ids, content-descriptions, texts, and element types, even for elements not immediately visible in the screenshot. Use this to find accurate and robust locators.\n"
+            "2.  A **Screenshot** of the current mobile screen (omitted when the screen is visually unchanged since the last screenshot, or when the UI Tree alone describes it).\n"
+            "3.  The **UI Tree (compact form)**, which lists every visible element you can act on or read, one per line, indented by nesting: "
+            "`<handle> <Class> \"<text>\" desc=\"<content-desc>\" label=\"<texts inside a row>\" #<resource-id> [flags]`. "
+            "Flags include click, longclick, scroll, edit, checked/unchecked, disabled and selected. Layout-only wrappers and default attributes are omitted.\n"
             "4.  (Optional) **Previous Action Outcome**: Information about the success or failure of your last suggested action.\n\n"
-            "Your task is to analyze the user goal, the visual screenshot, and the structured UI XML, then decide the single best next Appium action to take. "
-            "Think step-by-step to explain your reasoning before providing the JSON action. If you need to scroll to find an element, output a 'scroll' action first.\n"
+            "Your task is to analyze the user goal, the visual screenshot, and the structured UI tree, then decide the single best next Appium action to take. "
+            "Think step-by-step to explain your reasoning before providing the JSON action. If you need to scroll to find an element, output a 'scroll_to' action first.\n"
             "Output your action as a single JSON object. DO NOT include any text outside the JSON block. "
             "If the goal is achieved, state 'GOAL_ACHIEVED'. If the goal is impossible, state 'GOAL_IMPOSSIBLE'.\n\n"
 
             "**CRITICAL: Conditional Interaction and Verification:**\n"
             "When a goal involves ensuring elements are in a specific state (e.g., 'checked', 'ON'), you MUST:\n"
-            "1.  **Perceive Current State:** Identify the target element(s) by their unique text labels, IDs, or other attributes. Examine the `checked` attribute of the identified element(s) in the UI Tree XML.\n"
+            "1.  **Perceive Current State:** Identify the target element(s) by their unique text labels, IDs, or other attributes. Examine the `checked`/`unchecked` flag of the identified element(s) in the UI Tree.\n"
             "2.  **Act Conditionally:**\n"
-            "    * If the element is already in the **desired state** (e.g., `checked=\"true\"` for an 'ON' goal), DO NOT click it. State this in your thought and proceed to the next unfulfilled part of the goal.\n"
-            "    * If the element is **NOT** in the desired state (e.g., `checked=\"false\"` for an 'ON' goal), then perform a `click` action on *that specific element*.\n"
+            "    * If the element is already in the **desired state** (e.g., `checked` for an 'ON' goal), DO NOT click it. State this in your thought and proceed to the next unfulfilled part of the goal.\n"
+            "    * If the element is **NOT** in the desired state (e.g., `unchecked` for an 'ON' goal), then perform a `click` action on *that specific element*.\n"
             "3.  **Verify All before completion:** For goals like \"ensure all X are Y\", you must confirm that *every single* 'X' element specified in the user goal is in state 'Y' by re-inspecting the UI tree. Only output 'GOAL_ACHIEVED' when you have *confirmed* all specified conditions are met.\n"
             "    * If you've clicked an element and the UI tree for the next turn *still* shows it in the incorrect state, try clicking it again or re-evaluating.\n"
             "    * If no actions are possible and the desired state is still incorrect after multiple attempts, then declare GOAL_IMPOSSIBLE.\n\n"
 
             "**Crucial Navigation Hint:** When the user goal mentions an item 'in the main menu' or 'within the app', prioritize finding that item by its visible **text** or `content-desc` within the *current application's active window*. Avoid navigating to system applications like 'Settings' unless explicitly instructed.\n\n"
-            "**Crucial Scrolling Logic:** If your goal requires an element that is not visible on the current screen (as indicated by the UI Tree), you MUST issue a 'scroll' action in the necessary direction. If, after a scroll, the element is *still not visible*, or if a click action on the element just after a scroll failed (as indicated by 'Previous Action Outcome'), you must issue *another* 'scroll' action in the same direction. Continue scrolling iteratively until the target element becomes visible in the UI Tree, or until scrolling no longer changes the screen content (meaning you've reached the end of the scrollable area). Only attempt to 'click' an element when you have confirmed its presence in the UI Tree XML.\n\n"
+            "**Crucial Scrolling Logic:** If your goal requires an element that is not visible on the current screen (as indicated by the UI Tree), issue a single 'scroll_to' action naming the element by its full text, content-desc or resource-id (matched exactly, ignoring case). The executor keeps scrolling in that direction until the element is visible and reports one outcome: on success the element is in the next UI Tree; if it fails, the end of the scrollable area was reached (or the scroll limit hit) without finding it, so try the other direction or another label instead of repeating the same search; a 'partial_match' failure names a visible element that only contains the label. Use a plain 'scroll' only to reveal content you cannot name in advance. Only attempt to 'click' an element when you have confirmed its presence in the UI Tree.\n\n"
             "**Allowed JSON action formats:**\n"
             "1.  **Click Element:** `{\"action\": \"click\", \"by\": \"<AppiumBy_strategy>\", \"value\": \"<locator_value>\", \"thought\": \"<reasoning>\"}`\n"
-            "    (AppiumBy_strategy can be ID, ACCESSIBILITY_ID, XPATH, CLASS_NAME. Prioritize ID/ACCESSIBILITY_ID from XML. When navigating main menus within an app (e.g., ApiDemos), using **XPATH by text** is often robust for list items. If not unique, use XPATH by text or content-desc. If coordinates are only option, use 'COORDINATES' for 'by' and '[x,y]' for 'value'.)\n"
+            "    (AppiumBy_strategy can be HANDLE, ID, ACCESSIBILITY_ID, XPATH, CLASS_NAME. Prefer HANDLE with the element's handle from the UI Tree (e.g. `\"by\": \"HANDLE\", \"value\": \"e4dea\"`); it is mapped to a robust locator for you. Otherwise prioritize ID/ACCESSIBILITY_ID. When navigating main menus within an app (e.g., ApiDemos), using **XPATH by text** is often robust for list items. If not unique, use XPATH by text or content-desc. If coordinates are only option, use 'COORDINATES' for 'by' and '[x,y]' for 'value', measured in pixels of the screenshot you were sent.)\n"
             "2.  **Type Text:** `{\"action\": \"type\", \"text\": \"<text_to_type>\", \"by\": \"<AppiumBy_strategy>\", \"value\": \"<locator_value>\", \"thought\": \"<reasoning>\"}`\n"
-            "    (Target should be an input field. Use ID, ACCESSIBILITY_ID, or XPATH. Remember to press ENTER (keycode 66) after typing if necessary.)\n"
+            "    (Target should be an input field. Use HANDLE, ID, ACCESSIBILITY_ID, or XPATH. Remember to press ENTER (keycode 66) after typing if necessary.)\n"
             "3.  **Scroll:** `{\"action\": \"scroll\", \"direction\": \"<up|down|left|right>\", \"thought\": \"<reasoning to scroll. If a previous scroll didn't reveal the element, explain why another scroll is needed and why you haven't reached the end yet.>\"}`\n"
             "    (Only scroll if necessary to reveal an element for the next step. Ensure you describe why you need to scroll.)\n"
-            "4.  **Press Keycode:** `{\"action\": \"press_keycode\", \"key_code\": <android_keycode_int>, \"thought\": \"<reasoning>\"}`\n"
+            "4.  **Scroll To Element:** `{\"action\": \"scroll_to\", \"text\": \"<exact visible text>\", \"direction\": \"<up|down|left|right>\", \"thought\": \"<reasoning>\"}`\n"
+            "    (Use `\"desc\"` for a content-desc or `\"id\"` for a resource-id instead of, or together with, `\"text\"`. Direction defaults to down.)\n"
+            "5.  **Press Keycode:** `{\"action\": \"press_keycode\", \"key_code\": <android_keycode_int>, \"thought\": \"<reasoning>\"}`\n"
             "    (e.g., 4 for BACK, 66 for ENTER/Done on keyboard. Only use when explicitly needed for navigation or keyboard dismissal.)\n"
-            "5.  **Launch App:** `{\"action\": \"launch_app\", \"package\": \"<app_package>\", \"activity\": \"<app_activity>\", \"thought\": \"<reasoning>\"}`\n"
-            "6.  **Terminate App:** `{\"action\": \"terminate_app\", \"package\": \"<app_package>\", \"thought\": \"<reasoning>\"}`\n"
-            "7.  **GOAL_ACHIEVED:** `{\"action\": \"GOAL_ACHIEVED\", \"thought\": \"The user's goal has been successfully completed based on current screen analysis.\"}`\n"
-            "8.  **GOAL_IMPOSSIBLE:** `{\"action\": \"GOAL_IMPOSSIBLE\", \"thought\": \"I cannot achieve this goal given the current UI state or the constraints, or an unrecoverable error occurred.\"}`\n"
-            "Always provide a valid JSON object. Do not include extra text outside the JSON. Be precise with AppiumBy_strategy and locator_value by consulting the UI Tree XML."
+            "6.  **Launch App:** `{\"action\": \"launch_app\", \"package\": \"<app_package>\", \"activity\": \"<app_activity>\", \"thought\": \"<reasoning>\"}`\n"
+            "7.  **Terminate App:** `{\"action\": \"terminate_app\", \"package\": \"<app_package>\", \"thought\": \"<reasoning>\"}`\n"
+            "8.  **GOAL_ACHIEVED:** `{\"action\": \"GOAL_ACHIEVED\", \"thought\": \"The user's goal has been successfully completed based on current screen analysis.\"}`\n"
+            "9.  **GOAL_IMPOSSIBLE:** `{\"action\": \"GOAL_IMPOSSIBLE\", \"thought\": \"I cannot achieve this goal given the current UI state or the constraints, or an unrecoverable error occurred.\"}`\n"
+            "Always provide a valid JSON object. Do not include extra text outside the JSON. Be precise with AppiumBy_strategy and locator_value by consulting the UI Tree."
             "Here's an example for typing into the 'Custom Title' text field:\n"
             "Example Scenario: You are on the Custom Title screen and need to type into the text field.\n"
             "Screenshot: [image of custom title screen]\n"
             "UI Tree (relevant part for custom title text field):\n"
-            "```xml\n"
-            "<node class=\"android.widget.EditText\" resource-id=\"android:id/edit\" text=\"\" content-desc=\"Left is best\" />\n"
+            "```\n"
+            "e7c1a EditText desc=\"Left is best\" #edit [click,edit]\n"
             "```\n"
             "Expected Action: ```json\n"
-            "{\"action\": \"type\", \"text\": \"My New Title\", \"by\": \"ID\", \"value\": \"android:id/edit\", \"thought\": \"Identified the editable text field by its unique resource-id to type the new title.\"}\n"
+            "{\"action\": \"type\", \"text\": \"My New Title\", \"by\": \"HANDLE\", \"value\": \"e7c1a\", \"thought\": \"Identified the editable text field by its handle to type the new title.\"}\n"
             "```\n"
         )
+        if structured_output:
+            self.system_instruction += (
+                "\n**Response Format:** Your reply is parsed as JSON directly. Reply with the JSON object only, and put "
+                "your step-by-step reasoning in its `\"thought\"` field. For COORDINATES, give the value as `\"x,y\"`.\n"
+            )
+        if self.plan_mode == "batched":
+            self.system_instruction += (
+                "\n**Batched Plans:** When the next few steps are predictable from the current screen (e.g. toggling several "
+                "switches that are all visible), you may return them together instead of a single action: "
+                "`{\"plan\": [<action>, <action>, ...], \"thought\": \"<reasoning>\"}`. Every action except the last MUST carry an "
+                "`\"expect\"` postcondition describing the screen right after it, which is checked before the next step runs:\n"
+                "    * Element state: `{\"by\": \"HANDLE\", \"value\": \"e4dea\", \"checked\": true}`\n"
+                "    * Element present or gone: `{\"by\": \"HANDLE\", \"value\": \"e4dea\"}`, add `\"present\": false` for gone\n"
+                "    * Text present or gone: `{\"text\": \"Saved\"}`, add `\"present\": false` for gone\n"
+                f"At most {MAX_PLAN_STEPS} steps. Stop the plan before any step that navigates to a screen you cannot see yet. "
+                "You may end the plan with GOAL_ACHIEVED only if the postconditions of the earlier steps prove the goal is met. "
+                "If a postcondition fails, the remaining steps are dropped and you will be asked again with the new screen.\n"
+            )
+
+        # The instruction is sent once as the model's system prompt, not repeated in every user message
+        # (model= lets the offline benchmarks substitute a scripted stand-in)
+        self.model = model or genai.GenerativeModel(model_name=model_name, system_instruction=self.system_instruction)
 
     # ... (rest of the GeminiAgent class, AppiumExecutor class, and run_agentic_automation_with_gemini function remain the same) ...
 
-    def _prepare_image_for_gemini(self, screenshot_binary):
-        """Converts raw screenshot binary to a PIL Image object for Gemini."""
+    def _prepare_image_for_gemini(self, screenshot_binary, screenshot_image=None):
+        """Runs the raw screenshot through the image pipeline (crop, downscale, re-encode, unchanged check)."""
         try:
-            img_buffer = io.BytesIO(screenshot_binary)
-            img = Image.open(img_buffer)
-            return img
+            ui_tree = self.last_compact_tree.tree if self.last_compact_tree else None
+            with tracing.span("image_prep") as span:
+                processed = self.image_pipeline.process(screenshot_binary, ui_tree, image=screenshot_image)
+                span.set(original_bytes=processed.original_bytes, encoded_bytes=processed.encoded_bytes,
+                         unchanged=processed.unchanged)
+            if processed.unchanged:
+                print("[Image]: Screen unchanged since the last screenshot; not re-encoding it.")
+            else:
+                print(f"[Image]: {processed.original_bytes} -> {processed.encoded_bytes} bytes "
+                      f"({processed.size[0]}x{processed.size[1]} {self.image_pipeline.image_format}) "
+                      f"in {processed.encode_seconds * 1000:.0f} ms.")
+            return processed
         except Exception as e:
             print(f"[Image Preprocessing ERROR]: Could not prepare image for Gemini: {e}")
             raise
 
-    def analyze_and_plan(self, goal_text, screenshot_binary, ui_tree_xml, prev_action_outcome=None):
+    def _compact_ui_tree(self, ui_tree_xml):
+        """Compacts the raw page_source for the prompt, falling back to the raw XML if it cannot be parsed."""
+        try:
+            self.last_compact_tree = compact_ui_tree(ui_tree_xml, max_bytes=self.ui_tree_budget)
+        except Exception as e:
+            print(f"[UI Tree WARNING]: Could not compact UI tree, sending raw XML instead: {e}")
+            self.last_compact_tree = None
+            return ui_tree_xml
+        print(f"[UI Tree]: Compacted {self.last_compact_tree.original_bytes} -> "
+              f"{self.last_compact_tree.compact_bytes} bytes ({self.last_compact_tree.reduction:.0%} smaller).")
+        return self.last_compact_tree.text
+
+    def _resolve_handle(self, action):
+        """Replaces a HANDLE locator from the compact UI tree with the real Appium locator."""
+        if str(action.get("by", "")).upper() != "HANDLE":
+            return action
+        locator = self.last_compact_tree.locator_for_handle(action.get("value")) if self.last_compact_tree else None
+        if locator is None:
+            # Leave it unresolved; the executor reports it as a failure Gemini can react to
+            print(f"[Gemini Agent WARNING]: Unknown element handle '{action.get('value')}'.")
+            return action
+        resolved = dict(action, by=locator[0], value=locator[1], handle=action.get("value"))
+        print(f"   -> Resolved handle '{resolved['handle']}' to By={locator[0]}, Value='{locator[1]}'")
+        return resolved
+
+    def _resolve_coordinates(self, action):
+        """Maps COORDINATES given in screenshot pixels (cropped and downscaled) back to device pixels."""
+        if str(action.get("by", "")).upper() != "COORDINATES" or self.last_screenshot is None:
+            return action
+        value = action.get("value")
+        if isinstance(value, str): # "x,y", as structured output returns it
+            value = value.strip("[]() ").split(",")
+        try:
+            x, y = float(value[0]), float(value[1])
+        except (TypeError, ValueError, IndexError):
+            return action # Left as is; the executor reports it as a failure Gemini can react to
+        device_point = list(self.last_screenshot.to_device(x, y))
+        print(f"   -> Mapped screenshot point ({x:g}, {y:g}) to device coordinates {tuple(device_point)}")
+        return dict(action, value=device_point, screenshot_value=action.get("value"))
+
+    def _resolve_step(self, step):
+        """Resolves HANDLE locators and screenshot COORDINATES in a planned step, and HANDLEs in its postcondition."""
+        step = self._resolve_coordinates(self._resolve_handle(step))
+        if isinstance(step.get("expect"), dict):
+            step = dict(step, expect=self._resolve_handle(step["expect"]))
+        return step
+
+    def _send(self, history, content):
+        """
+        One model call. Returns (response text, action parsed while streaming or None, stopped early, usage).
+        A model that rejects the structured output config is retried once without it.
+        """
+        while True:
+            options = {"generation_config": self.generation_config} if self.generation_config else {}
+            try:
+                with self.rate_limiter:
+                    response = self.model.start_chat(history=history).send_message(
+                        content, stream=self.streaming, **options)
+                    if self.streaming:
+                        text, parsed, stopped_early = read_first_action(response)
+                    else:
+                        text, parsed, stopped_early = response.text, None, False
+            except InvalidArgument as e:
+                if not options:
+                    raise
+                print(f"[Gemini Agent WARNING]: Structured output not accepted ({e}); using free-form JSON.")
+                self.generation_config = None
+                continue
+            try:
+                usage = response.usage_metadata
+            except Exception: # Not available on every (cancelled) stream
+                usage = None
+            return text.strip(), parsed, stopped_early, usage
+
+    def _request_action(self, history, prompt_parts, span):
+        """
+        Asks Gemini for the next action and parses it: streamed extraction or the fast parse path, then local
+        repair, then up to PLANNER_PARSE_RETRIES text-only retries. Returns (response text, parsed or None).
+        """
+        start = time.perf_counter()
+        response_text, parsed, stopped_early, usage = self._send(history, prompt_parts)
+        method = "streamed" if parsed is not None else None
+        retries = 0
+        while True:
+            if parsed is None:
+                with tracing.span("json_parse", response_chars=len(response_text)):
+                    try:
+                        parsed, method = parse_action_text(response_text)
+                    except json.JSONDecodeError:
+                        parsed, method = None, None
+            self.planner_stats.record_response(method)
+            if parsed is not None or retries >= PLANNER_PARSE_RETRIES:
+                break
+            retries += 1
+            print(f"[Gemini Agent WARNING]: Could not parse or repair the response; asking again (retry {retries}).")
+            # The screenshot is left out of the retry; the model only has to restate its answer
+            retry_history = history + [{"role": "user", "parts": [p for p in prompt_parts if isinstance(p, str)]},
+                                       {"role": "model", "parts": [response_text or "(empty reply)"]}]
+            response_text, parsed, stopped_early, usage = self._send(retry_history, PARSE_RETRY_PROMPT)
+            method = "streamed" if parsed is not None else None
+
+        seconds = time.perf_counter() - start
+        self.planner_stats.record(seconds, parsed is not None, stopped_early, retries)
+        print(f"[Gemini Agent]: Action ready after {seconds:.2f}s ({method or 'unparseable'}"
+              f"{', rest of the stream cancelled' if stopped_early else ''}{f', {retries} retries' if retries else ''}).")
+        span.set(time_to_action_ms=round(seconds * 1000, 1), parse=method, stopped_early=stopped_early, retries=retries)
+        if usage is not None:
+            span.set(prompt_tokens=getattr(usage, "prompt_token_count", None),
+                     output_tokens=getattr(usage, "candidates_token_count", None),
+                     total_tokens=getattr(usage, "total_token_count", None))
+        return response_text, parsed
+
+    def remember_cached_action(self, fingerprint, action):
+        """Records a turn whose action came from the plan cache, so later prompts still see it."""
+        self.memory.record_turn(fingerprint, f"[Screen {fingerprint}: action replayed from plan cache]",
+                                None, 0, json.dumps(action), action)
+
+    def analyze_and_plan(self, goal_text, screenshot_binary, ui_tree_xml, prev_action_outcome=None,
+                         screenshot_image=None):
         """
         Sends the goal, screenshot, UI tree, and previous action outcome to Gemini to get the next action.
+        screenshot_binary may be None when the orchestrator decided the UI tree alone is enough;
+        screenshot_image is the same screenshot already decoded during perception, if it was.
         """
-        image_part = self._prepare_image_for_gemini(screenshot_binary)
+        build_span = tracing.span("prompt_build")
+        ui_tree_text = self._compact_ui_tree(ui_tree_xml)
+        screenshot = (self._prepare_image_for_gemini(screenshot_binary, screenshot_image)
+                      if screenshot_binary else None)
+        if screenshot is not None:
+            self.last_screenshot = screenshot
 
         # Construct the prompt payload for Gemini
-        prompt_parts = [
-            self.system_instruction,
-            f"\n\nUser Goal: {goal_text}",
-            "\n\nCurrent Mobile Screen (Screenshot):",
-            image_part, # PIL Image object directly
-            "\n\nUI Tree (XML Structure - for precise element attributes):",
-            f"\n```xml\n{ui_tree_xml}\n```",
-        ]
+        prompt_parts = [f"User Goal: {goal_text}"]
+        if screenshot is None:
+            prompt_parts.append("\n\nCurrent Mobile Screen: (no screenshot this turn; use the UI Tree)")
+        elif screenshot.unchanged and (self.memory.mode == "full" or self.image_pipeline.last_part is None):
+            # Only "full" memory still carries the previous screenshot in the history
+            prompt_parts.append("\n\nCurrent Mobile Screen: (visually unchanged since the previous screenshot)")
+        elif screenshot.unchanged:
+            # Window and digest memory strip earlier images, so the last encoded frame is sent again as is
+            prompt_parts.extend(["\n\nCurrent Mobile Screen (Screenshot, visually unchanged since the previous one):",
+                                 self.image_pipeline.last_part])
+        else:
+            prompt_parts.extend(["\n\nCurrent Mobile Screen (Screenshot):", screenshot.part])
+        prompt_parts.extend([
+            "\n\nUI Tree (compact form - for precise element attributes and handles):",
+            f"\n```\n{ui_tree_text}\n```",
+        ])
         if prev_action_outcome: # Add previous action outcome if available
             prompt_parts.append(f"\n\nPrevious Action Outcome: {prev_action_outcome}")
 
-        prompt_parts.append("\n\nWhat is the next action (JSON format)? Provide a precise action with reasoning.")
+        if self.plan_mode == "batched":
+            prompt_parts.append("\n\nWhat are the next actions (a single JSON action, or a JSON plan with postconditions)? "
+                                "Provide precise actions with reasoning.")
+        else:
+            prompt_parts.append("\n\nWhat is the next action (JSON format)? Provide a precise action with reasoning.")
 
-        try:
-            # Send the request to Gemini, maintaining conversation history for context
-            convo = self.model.start_chat(history=self.chat_history)
-            response = convo.send_message(prompt_parts)
+        # Earlier turns are remembered without their screenshot and UI tree
+        fingerprint = screen_fingerprint(self.last_compact_tree.tree) if self.last_compact_tree else "unknown"
+        remembered_text = f"[Screen {fingerprint}: screenshot and UI tree omitted]"
+        if prev_action_outcome:
+            remembered_text += f"\nPrevious Action Outcome: {prev_action_outcome}"
+        prompt_bytes = sum(part_bytes(part) for part in prompt_parts)
+        build_span.set(prompt_bytes=prompt_bytes, ui_tree_bytes=len(ui_tree_text.encode("utf-8")))
+        build_span.finish()
 
-            # Update chat history for the next turn
-            self.chat_history = convo.history
+        response_text = ""
+        try:
+            # Send the request to Gemini with the bounded conversation history for context
+            history = self.memory.build_history()
+            request_bytes = self.memory.record_request(history, prompt_parts)
+            with tracing.span("model_call", request_bytes=request_bytes, history_messages=len(history)) as span:
+                response_text, parsed = self._request_action(history, prompt_parts, span)
 
-            # Extract the action from Gemini's response
-            response_text = response.text.strip()
             print(f"\n[Gemini Agent Raw Response]:\n{response_text}")
+            turn = self.memory.record_turn(fingerprint, remembered_text, prompt_parts, prompt_bytes, response_text, None)
+            if parsed is None:
+                raise json.JSONDecodeError("No parseable JSON action in the response", response_text, 0)
 
-            # Robustly parse the JSON response from Gemini
-            json_match = re.search(r"```json\s*(\{.*?\})\s*```", response_text, re.DOTALL)
-            if json_match:
-                action_json_str = json_match.group(1)
-            else:
-                # Fallback: if no code block, try to parse the entire response as JSON
-                action_json_str = response_text
-
-            action = json.loads(action_json_str)
+            steps = [self._resolve_step(step) for step in plan_steps(parsed, MAX_PLAN_STEPS)]
+            action = steps[0] if len(steps) == 1 else {"action": "PLAN", "steps": steps}
+            turn.action = action
             return action
 
         except json.JSONDecodeError as e:
@@ -174,11 +459,98 @@ class GeminiAgent:
 
 # --- Appium Executor (Translates Gemini's action to Appium commands) ---
 class AppiumExecutor:
-    def __init__(self, driver_instance):
+    def __init__(self, driver_instance, settle_waiter=None, direct_tap=DIRECT_TAP_RESOLVED_ELEMENTS):
         self.driver = driver_instance
         self.wait = WebDriverWait(driver_instance, 30) # Use the passed driver instance
+        self.settle_waiter = settle_waiter or UiSettleWaiter(driver_instance, log_path=SETTLE_LOG_PATH)
+        self.direct_tap = direct_tap
+        self.element_index = None # ElementIndex of the screen the current action was planned on
+        self.ui_tree_xml = None # page_source that element_index was built from
+
+    def update_element_index(self, ui_tree):
+        """Indexes the page_source captured at perception time so locators can be checked locally."""
+        self.ui_tree_xml = ui_tree
+        try:
+            self.element_index = ElementIndex(ui_tree)
+        except Exception as e:
+            print(f"[Executor WARNING]: Could not index UI tree; locators will only be checked on the device: {e}")
+            self.element_index = None
+
+    def _resolve_locally(self, locator_by_str, locator_value):
+        """Returns the local Resolution of a locator, or None when no index is available."""
+        if self.element_index is None or not isinstance(locator_value, str):
+            return None
+        return self.element_index.resolve(locator_by_str, locator_value)
+
+    def _locator_not_found(self, locator_by_str, locator_value, resolution):
+        """Immediate failure for a locator that matches nothing in the current UI tree."""
+        suggestions = "; ".join(self.element_index.describe(node) for node in resolution.suggestions)
+        details = f"No element matches By={locator_by_str}, Value='{locator_value}' in the current UI tree."
+        if suggestions:
+            details += f" Closest matches: {suggestions}"
+        print(f"[Executor ERROR]: {details}")
+        return {"status": "failed", "reason": "element_not_found", "details": details}
 
     def execute_action(self, action):
+        """Executes the action, then waits only as long as the UI actually needs to settle."""
+        with tracing.span("action", action=action.get("action")) as span:
+            result = self._perform_action(action)
+            span.set(status=result["status"], reason=result.get("reason"))
+        with tracing.span("settle", action=action.get("action")) as span:
+            samples_before = len(self.settle_waiter.samples)
+            result["settle_time"] = self.settle_waiter.wait(action.get("action"), result["status"])
+            if len(self.settle_waiter.samples) > samples_before:
+                sample = self.settle_waiter.samples[-1]
+                span.set(polls=sample["polls"], timed_out=sample["timed_out"])
+        return result
+
+    def _wait_for_element(self, locator_by, locator_value):
+        """Waits for the element through the server, recording how many lookups it took."""
+        located = EC.presence_of_element_located((locator_by, locator_value))
+        attempts = 0
+
+        def attempt(driver):
+            nonlocal attempts
+            attempts += 1
+            return located(driver)
+
+        with tracing.span("element_wait", by=locator_by) as span:
+            try:
+                return self.wait.until(attempt)
+            finally:
+                span.set(retries=max(0, attempts - 1))
+
+    def _scroll_to(self, action):
+        """Scrolls locally until the target is visible, so a long list costs one model call instead of one per scroll."""
+        target = parse_target(action)
+        direction = str(action.get("direction", "down")).lower()
+        max_scrolls = min(int(action.get("max_scrolls", SCROLL_TO_MAX_SCROLLS)), SCROLL_TO_MAX_SCROLLS)
+
+        def settle():
+            self.settle_waiter.wait("scroll")
+            return self.settle_waiter.last_page_source
+
+        with tracing.span("scroll_search", direction=direction) as span:
+            result = scroll_until_found(self.driver, target, direction, max_scrolls, settle=settle,
+                                        ui_tree_xml=self.ui_tree_xml if isinstance(self.ui_tree_xml, str) else None)
+            span.set(status=result.status, scrolls=result.scrolls)
+        self.update_element_index(result.ui_tree_xml)
+        if result.found:
+            print(f"   -> Found {describe_target(target)} after {result.scrolls} scrolls {direction} "
+                  f"in {result.seconds:.2f}s.")
+            return {"status": "success", "scrolls": result.scrolls}
+        stop = "reached the end of the list" if result.status != "max_scrolls" else f"hit the limit of {max_scrolls} scrolls"
+        details = f"No visible element with {describe_target(target)} after {result.scrolls} scrolls {direction}; {stop}."
+        reason = "target_not_found"
+        if result.partial_node is not None:
+            reason = "partial_match"
+            node = result.partial_node
+            details += (f" Only a partial match is visible: {node.short_class} "
+                        f"'{node.text or node.content_desc or node.resource_id}'; check whether it is the intended element.")
+        print(f"[Executor ERROR]: {details}")
+        return {"status": "failed", "reason": reason, "details": details, "scrolls": result.scrolls}
+
+    def _perform_action(self, action):
         action_type = action.get("action")
         thought = action.get("thought", "No specific thought provided.")
         print(f"\n[Executor]: Executing action '{action_type}' (Thought: {thought})")
@@ -188,13 +560,22 @@ class AppiumExecutor:
                 locator_by_str = action["by"].upper()
                 locator_value = action["value"]
                 if locator_by_str == "COORDINATES": # Special case for coordinates
+                    if isinstance(locator_value, str): # "x,y", as structured output returns it
+                        locator_value = [int(float(v)) for v in locator_value.strip("[]() ").split(",")]
                     x, y = locator_value[0], locator_value[1]
                     self.driver.tap([(x, y)])
                     print(f"   -> Tapped coordinates: ({x}, {y})")
                 else:
+                    resolution = self._resolve_locally(locator_by_str, locator_value)
+                    if resolution and resolution.status == MISSING:
+                        return self._locator_not_found(locator_by_str, locator_value, resolution)
+                    if self.direct_tap and resolution and resolution.center:
+                        self.driver.tap([resolution.center])
+                        print(f"   -> Tapped resolved element at {resolution.center}: By={locator_by_str}, Value='{locator_value}'")
+                        return {"status": "success"}
                     locator_by = getattr(AppiumBy, locator_by_str)
                     # Use presence_of_element_located for more robustness against clickable issues
-                    element = self.wait.until(EC.presence_of_element_located((locator_by, locator_value))) 
+                    element = self._wait_for_element(locator_by, locator_value)
                     element.click()
                     print(f"   -> Clicked element: By={locator_by_str}, Value='{locator_value}'")
                 return {"status": "success"}
@@ -203,8 +584,11 @@ class AppiumExecutor:
                 locator_by_str = action["by"].upper()
                 locator_value = action["value"]
                 text_to_type = action["text"]
+                resolution = self._resolve_locally(locator_by_str, locator_value)
+                if resolution and resolution.status == MISSING:
+                    return self._locator_not_found(locator_by_str, locator_value, resolution)
                 locator_by = getattr(AppiumBy, locator_by_str)
-                element = self.wait.until(EC.presence_of_element_located((locator_by, locator_value)))
+                element = self._wait_for_element(locator_by, locator_value)
                 element.send_keys(text_to_type)
                 self.driver.press_keycode(66) # Press Enter
                 print(f"   -> Typed '{text_to_type}' into element: By={locator_by_str}, Value='{locator_value}'. Pressed Enter.")
@@ -224,6 +608,9 @@ class AppiumExecutor:
                 print(f"   -> Scrolled {direction}.")
                 return {"status": "success"}
 
+            elif action_type == "scroll_to":
+                return self._scroll_to(action)
+
             elif action_type == "press_keycode":
                 key_code = action["key_code"]
                 self.driver.press_keycode(key_code)
@@ -270,76 +657,180 @@ class AppiumExecutor:
             print(f"   Details: {e}")
             self.driver.save_screenshot("execution_error_general.png")
             return {"status": "failed", "reason": "general_error", "details": str(e)}
-        finally:
-            time.sleep(2)
 
 
 # --- Main Agentic Automation Loop ---
-def run_agentic_automation_with_gemini(user_goal):
-    global driver, wait # Ensure we operate on the global driver and wait objects
-
+def _screenshot_needed(ui_tree_xml, prev_action_outcome):
+    """Applies SCREENSHOT_MODE to decide whether this turn needs a screenshot."""
+    if SCREENSHOT_MODE == "always":
+        return True
+    if SCREENSHOT_MODE == "never":
+        return False
+    if prev_action_outcome: # A failed action is easier to diagnose visually
+        return True
     try:
-        appium_options = UiAutomator2Options().load_capabilities(capabilities)
-        print("Starting Appium session...")
-        driver = webdriver.Remote(APPIUM_SERVER_URL, options=appium_options)
-        print("Appium session started successfully!")
-        wait = WebDriverWait(driver, 30) # Initialize WebDriverWait here
+        return ui_tree_needs_screenshot(ui_tree_xml)
+    except Exception:
+        return True
+
+def _screenshot_likely(after_failure, previous_screen_needed):
+    """Guesses, before the UI tree has arrived, whether the turn will need a screenshot, so both are captured at once."""
+    if SCREENSHOT_MODE == "always":
+        return True
+    if SCREENSHOT_MODE == "never":
+        return False
+    return bool(after_failure) or previous_screen_needed
 
-        gemini_agent = GeminiAgent()
-        appium_executor = AppiumExecutor(driver) # Pass the initialized driver
+def _settled_page_source(appium_executor):
+    """The page_source the settle wait ended on, if the screen did settle within its budget."""
+    waiter = appium_executor.settle_waiter
+    if waiter.last_page_source is None or not waiter.samples or waiter.samples[-1]["timed_out"]:
+        return None
+    return waiter.last_page_source
 
-        max_turns = 20 # Increased max turns for more attempts, especially with scrolling
-        final_status = "Unknown"
-        prev_action_outcome = None # To pass feedback to Gemini
+def run_goal(driver, user_goal, gemini_agent=None, appium_executor=None, max_turns=20, rate_limiter=None,
+             recorder=None, screen_capture=None):
+    """
+    Runs the Perceive-Plan-Act loop for one goal on an existing Appium session.
+    Returns a dict with the final status, the turns taken and the number of Gemini calls.
+    Executed steps go to recorder (a TrajectoryRecorder); by default one is used when TRAJECTORY_DIR is set.
+    """
+    gemini_agent = gemini_agent or GeminiAgent(rate_limiter=rate_limiter)
+    appium_executor = appium_executor or AppiumExecutor(driver)
+    owns_screen_capture = screen_capture is None
+    screen_capture = screen_capture or ScreenCapture(driver, **PERCEPTION_SETTINGS)
+    screenshot_was_needed = False # Whether the previous screen needed a screenshot, to guess for the next one
+    plan_cache = PlanCache(PLAN_CACHE_PATH) if PLAN_CACHE_ENABLED else None
+    if recorder is None and TRAJECTORY_DIR:
+        recorder = TrajectoryRecorder(user_goal, trajectory_path(TRAJECTORY_DIR, user_goal))
+    track_screens = plan_cache is not None or recorder is not None
+    visited_screens = set() # Fingerprints seen in this run; a revisited screen is never served from the cache
+    goal_span = tracing.span("goal", root=True, goal=(user_goal.strip().splitlines() or [""])[0][:80])
+    turn_span = tracing.NULL_SPAN
+    model_calls = 0
+    actions_executed = 0
+    batched_steps = 0 # plan steps run without a Gemini call of their own
 
-        for turn in range(max_turns):
-            print(f"\n--- Agent Turn {turn + 1}/{max_turns} ---")
+    final_status = "Unknown"
+    prev_action_outcome = None # To pass feedback to Gemini
+    turns_taken = 0
 
-            # 1. Perception: Get current screen state
+    for turn in range(max_turns):
+        turns_taken = turn + 1
+        turn_span.finish()
+        turn_span = tracing.span("turn", turn=turns_taken)
+        print(f"\n--- Agent Turn {turn + 1}/{max_turns} ---")
+
+        # 1. Perception: Get current screen state (the screenshot alongside it when it is likely needed)
+        try:
+            with tracing.span("perception") as span:
+                perception = screen_capture.capture(_screenshot_likely(prev_action_outcome, screenshot_was_needed))
+                span.set(prefetched=perception.prefetched)
+            ui_tree_xml = perception.ui_tree_xml
+            print("[Orchestrator]: Captured current UI tree XML" + (" (prefetched after settle)." if perception.prefetched else "."))
+        except WebDriverException as e:
+            print(f"[Orchestrator ERROR]: Failed to capture screen or page source: {e}. Cannot proceed.")
+            final_status = "Perception_Failed"
+            break
+        appium_executor.update_element_index(ui_tree_xml)
+
+        # 2. Planning: Reuse a cached action for this exact screen, otherwise ask Gemini
+        fingerprint = None
+        action = None
+        revisited = False
+        if track_screens:
             try:
-                screenshot_binary = driver.get_screenshot_as_png()
-                ui_tree_xml = driver.page_source
-                print("[Orchestrator]: Captured current screen state (screenshot + UI tree XML).")
+                fingerprint = screen_fingerprint(ui_tree_xml)
+                # Replaying the action cached for a screen already seen in this run would loop between screens
+                revisited = fingerprint in visited_screens
+                visited_screens.add(fingerprint)
+                action = plan_cache.get(user_goal, fingerprint) if plan_cache and not revisited else None
+            except Exception as e:
+                print(f"[Orchestrator WARNING]: Could not fingerprint the current screen: {e}")
+        from_cache = action is not None
+        if from_cache:
+            print(f"[Orchestrator]: Plan cache hit for screen {fingerprint}; skipping Gemini. Action: {action}")
+            gemini_agent.remember_cached_action(fingerprint, action)
+        else:
+            try:
+                screenshot_binary = screenshot_image = None
+                screenshot_was_needed = _screenshot_needed(ui_tree_xml, prev_action_outcome)
+                if screenshot_was_needed:
+                    screenshot_binary, screenshot_image = screen_capture.screenshot(perception)
+                    print("[Orchestrator]: Captured screenshot.")
             except WebDriverException as e:
-                print(f"[Orchestrator ERROR]: Failed to capture screen or page source: {e}. Cannot proceed.")
+                print(f"[Orchestrator ERROR]: Failed to capture screenshot: {e}. Cannot proceed.")
                 final_status = "Perception_Failed"
                 break
-
-            # 2. Planning: Ask Gemini for the next action
             print("[Orchestrator]: Consulting Gemini for the next action based on goal, screen, and UI tree...")
-            action = gemini_agent.analyze_and_plan(user_goal, screenshot_binary, ui_tree_xml, prev_action_outcome)
+            action = gemini_agent.analyze_and_plan(user_goal, screenshot_binary, ui_tree_xml, prev_action_outcome,
+                                                   screenshot_image=screenshot_image)
+            model_calls += 1
+        screen_capture.finish(perception)
+
+        # Reset prev_action_outcome for the next turn unless it's explicitly set by a failure below
+        prev_action_outcome = None 
 
-            # Reset prev_action_outcome for the next turn unless it's explicitly set by a failure below
-            prev_action_outcome = None 
+        # A batched plan runs step by step while each step's postcondition holds on the refreshed UI tree
+        steps = action["steps"] if action.get("action") == "PLAN" else [action]
+        step_outcomes = []
+        for step_number, step in enumerate(steps):
+            if step_number > 0:
+                print(f"[Orchestrator]: Plan step {step_number + 1}/{len(steps)} (no Gemini call).")
+                batched_steps += 1
 
             # Check for immediate termination signals from Gemini
-            if action.get("action") == "GOAL_ACHIEVED":
+            if step.get("action") == "GOAL_ACHIEVED":
+                if plan_cache and fingerprint and not from_cache and not revisited:
+                    plan_cache.put(user_goal, fingerprint, step)
+                if recorder:
+                    recorder.record(fingerprint, step, "goal_achieved")
                 final_status = "Goal_Achieved"
                 print(f"\n[Agent]: Goal '{user_goal}' achieved after {turn + 1} turns!")
                 break
-            elif action.get("action") == "GOAL_IMPOSSIBLE":
+            elif step.get("action") == "GOAL_IMPOSSIBLE":
                 final_status = "Goal_Impossible"
                 print(f"\n[Agent]: Goal '{user_goal}' deemed impossible after {turn + 1} turns. Stopping.")
                 break
-            elif action.get("action") == "ERROR":
-                final_status = f"Gemini_Error: {action.get('message')}"
-                print(f"\n[Agent]: Error from Gemini. Stopping. Raw response: {action.get('raw_response')}")
+            elif step.get("action") == "ERROR":
+                final_status = f"Gemini_Error: {step.get('message')}"
+                print(f"\n[Agent]: Error from Gemini. Stopping. Raw response: {step.get('raw_response')}")
                 break
-            
+
             # 3. Execution: Perform the action
-            execution_result = appium_executor.execute_action(action)
+            execution_result = appium_executor.execute_action(step)
+            actions_executed += 1
+            step_failed = execution_result["status"] == "failed"
+            if step_failed or (execution_result["status"] == "success" and step_number == len(steps) - 1):
+                # The next turn starts from this settled screen; capture it while the bookkeeping below runs
+                screen_capture.prefetch(_screenshot_likely(step_failed, screenshot_was_needed),
+                                        _settled_page_source(appium_executor))
+            outcome = execution_result["status"]
+            if outcome == "failed":
+                outcome += f": {execution_result['reason']}"
+            step_outcomes.append(outcome)
+            if recorder:
+                recorder.record(fingerprint, step, execution_result["status"], execution_result.get("settle_time", 0.0))
+
+            if plan_cache and fingerprint:
+                if execution_result["status"] == "failed" and from_cache:
+                    plan_cache.invalidate(user_goal, fingerprint)
+                elif execution_result["status"] == "success" and not from_cache and not revisited:
+                    plan_cache.put(user_goal, fingerprint, step)
 
             if execution_result["status"] == "failed":
                 # Provide feedback to Gemini for the next turn
                 prev_action_outcome = (
-                    f"Last action '{action.get('action')}' "
-                    f"with value '{action.get('value', 'N/A')}' "
+                    f"Last action '{step.get('action')}' "
+                    f"with value '{step.get('value', 'N/A')}' "
                     f"failed because: {execution_result['reason']}. "
                     f"Details: {execution_result['details']}. "
                     f"Please re-evaluate the current screen and plan the next step."
                 )
+                if step_number < len(steps) - 1:
+                    prev_action_outcome += f" The remaining {len(steps) - step_number - 1} planned steps were not executed."
                 print(f"\n[Agent]: Action failed during execution. Current plan may be invalid. Will re-plan.")
-                # DO NOT BREAK here; allow the loop to continue and feed the failure to Gemini
+                break # Only the plan is abandoned; the next turn feeds the failure to Gemini
             elif execution_result["status"] == "goal_achieved":
                 final_status = "Goal_Achieved"
                 print(f"\n[Agent]: Goal '{user_goal}' achieved after {turn + 1} turns!")
@@ -350,9 +841,93 @@ def run_agentic_automation_with_gemini(user_goal):
                 break
             # If status is "success" or "unknown_action", prev_action_outcome remains None and the loop continues
 
-            if turn == max_turns - 1:
-                final_status = "Max_Turns_Reached"
-                print(f"\n[Agent]: Reached maximum allowed turns ({max_turns}) without achieving the goal. Stopping.")
+            if step_number == len(steps) - 1:
+                break # Plan used up; the next turn perceives the screen and asks Gemini again
+            # Check this step's postcondition on a fresh page_source before running the next one
+            try:
+                with tracing.span("page_source", purpose="postcondition") as span:
+                    ui_tree_xml = _settled_page_source(appium_executor) or driver.page_source
+                    span.set(bytes=len(ui_tree_xml))
+            except WebDriverException as e:
+                print(f"[Orchestrator ERROR]: Failed to capture page source: {e}. Cannot proceed.")
+                final_status = "Perception_Failed"
+                break
+            appium_executor.update_element_index(ui_tree_xml)
+            try:
+                ok, reason = check_postcondition(appium_executor.element_index or ui_tree_xml, step["expect"])
+                fingerprint = screen_fingerprint(ui_tree_xml) if track_screens else None
+                revisited = fingerprint in visited_screens
+                visited_screens.add(fingerprint)
+            except Exception as e:
+                ok, reason = None, str(e)
+            if not ok:
+                print(f"[Orchestrator]: Postcondition of plan step {step_number + 1} not met ({reason}); re-planning.")
+                step_outcomes[-1] += f" (postcondition {'failed' if ok is False else 'unchecked'}: {reason})"
+                prev_action_outcome = (
+                    f"Planned step {step_number + 1} ('{step.get('action')}' with value '{step.get('value', 'N/A')}') "
+                    f"was executed, but its postcondition {json.dumps(step['expect'])} "
+                    f"{'failed' if ok is False else 'could not be checked'}: {reason}. "
+                    f"The remaining {len(steps) - step_number - 1} planned steps were not executed. "
+                    f"Please re-evaluate the current screen and plan the next step."
+                )
+                screen_capture.prefetch(_screenshot_likely(True, screenshot_was_needed), ui_tree_xml)
+                break
+            from_cache = False # The next step came from Gemini, so it may be cached under this screen
+
+        if step_outcomes:
+            gemini_agent.memory.record_outcome(", ".join(step_outcomes))
+        if final_status != "Unknown":
+            break
+
+        if turn == max_turns - 1:
+            final_status = "Max_Turns_Reached"
+            print(f"\n[Agent]: Reached maximum allowed turns ({max_turns}) without achieving the goal. Stopping.")
+
+    turn_span.finish()
+    goal_span.set(status=final_status, turns=turns_taken, model_calls=model_calls, actions=actions_executed)
+    goal_span.finish()
+
+    print(gemini_agent.memory.payload_summary())
+    print(gemini_agent.planner_stats.summary())
+    print(appium_executor.settle_waiter.summary())
+    print(screen_capture.summary())
+    if owns_screen_capture:
+        screen_capture.close()
+    if plan_cache:
+        if final_status == "Goal_Achieved":
+            plan_cache.commit() # A failed or timed-out run leaves only its invalidations behind
+        plan_cache.flush()
+        print(plan_cache.stats_summary())
+    if recorder:
+        recorder.finish(final_status)
+    print(f"[Orchestrator]: {model_calls} Gemini calls for {actions_executed} actions in this goal "
+          f"(single-step planning would have needed {model_calls + batched_steps}).")
+    return {"status": final_status, "turns": turns_taken, "model_calls": model_calls,
+            "actions": actions_executed, "single_step_model_calls": model_calls + batched_steps}
+
+
+def create_driver(device_capabilities=None):
+    """Starts an Appium UiAutomator2 session (default: the module-level capabilities)."""
+    appium_options = UiAutomator2Options().load_capabilities(device_capabilities or capabilities)
+    print("Starting Appium session...")
+    if AppiumClientConfig is not None:
+        # A larger connection pool lets concurrent perception captures each use their own keep-alive socket
+        client_config = AppiumClientConfig(remote_server_addr=APPIUM_SERVER_URL, init_args_for_pool_manager={
+            "init_args_for_pool_manager": {"maxsize": APPIUM_HTTP_POOL_SIZE}})
+        driver = webdriver.Remote(APPIUM_SERVER_URL, options=appium_options, client_config=client_config)
+    else:
+        driver = webdriver.Remote(APPIUM_SERVER_URL, options=appium_options)
+    print("Appium session started successfully!")
+    return driver
+
+
+def run_agentic_automation_with_gemini(user_goal, device_capabilities=None):
+    """Starts a session, runs one goal on it and quits. Returns the final status."""
+    driver = None
+    final_status = "Unknown"
+    try:
+        driver = create_driver(device_capabilities)
+        final_status = run_goal(driver, user_goal)["status"]
 
     except Exception as e:
         final_status = f"Overall_System_Error: {e}"
@@ -367,6 +942,127 @@ def run_agentic_automation_with_gemini(user_goal):
             print("Quitting Appium session...")
             driver.quit()
             print("Appium session closed.")
+    return final_status
+
+
+def run_goals_in_parallel(goals, device_capabilities_list):
+    """
+    Runs goals concurrently, one session and AppiumExecutor per device and one GeminiAgent per goal.
+    Returns a device_pool.GoalResult per goal, in order.
+    """
+    rate_limiter = ModelRateLimiter(MAX_CONCURRENT_MODEL_CALLS, MODEL_CALLS_PER_MINUTE)
+    executors = {} # id(driver) -> AppiumExecutor; each entry is only touched by its device's worker
+
+    def run_on_device(driver, goal):
+        executor = executors.get(id(driver))
+        if executor is None or executor.driver is not driver: # new or reconnected session
+            executor = executors[id(driver)] = AppiumExecutor(driver)
+        else: # warm session: restart the app instead of the session
+            reset_app(driver, capabilities['appium:appPackage'], capabilities['appium:appActivity'])
+        return run_goal(driver, goal, appium_executor=executor, rate_limiter=rate_limiter)
+
+    pool = DevicePool(device_capabilities_list, driver_factory=create_driver,
+                      goal_runner=run_on_device, rate_limiter=rate_limiter)
+    return pool.run(goals)
+
+
+def run_goals_in_session(goals, device_capabilities=None):
+    """
+    Runs goals one after another through a single warm Appium session, restarting only the app
+    between goals. Prints the per-goal startup overhead (session creation or app reset).
+    """
+    results = []
+    with SessionManager(device_capabilities or capabilities, create_driver) as session:
+        executor = None
+        for index, goal in enumerate(goals):
+            print(f"\n=== Goal {index + 1}/{len(goals)} ===")
+            try:
+                # The first goal runs on the app state the session was started with
+                driver = session.acquire(reset=index > 0)
+            except Exception as e:
+                print(f"[Session ERROR]: No Appium session for this goal: {e}")
+                results.append({"goal": goal, "status": f"Session_Failed: {e}", "turns": 0, "model_calls": 0,
+                                "startup_seconds": 0.0, "goal_seconds": 0.0})
+                continue
+            if executor is None or executor.driver is not driver: # new or reconnected session
+                executor = AppiumExecutor(driver)
+            start = time.perf_counter()
+            try:
+                result = run_goal(driver, goal, appium_executor=executor)
+            except Exception as e:
+                print(f"[Agentic Automation ERROR]: An error occurred during the main agent loop: {e}")
+                result = {"status": f"Overall_System_Error: {e}", "turns": 0, "model_calls": 0}
+            finally:
+                session.release()
+            result.update(goal=goal, startup_seconds=session.last_startup_seconds,
+                          goal_seconds=time.perf_counter() - start)
+            results.append(result)
+
+        print(f"\n[Session]: {len(results)} goals, {session.sessions_created} session(s) created "
+              f"({session.session_seconds:.1f}s total).")
+        for result in results:
+            print(f"   {result['status']:24} startup {result['startup_seconds']:5.1f}s  goal {result['goal_seconds']:6.1f}s  "
+                  f"{result['goal'].strip().splitlines()[0][:50]}")
+    return results
+
+
+def replay_goal(driver, path, appium_executor=None):
+    """
+    Replays a recorded trajectory without Gemini. At the first divergence the goal is handed back to
+    GeminiAgent from the current screen, and the recording is patched with the new steps from there on.
+    Returns (ReplayResult, Gemini calls spent repairing).
+    """
+    appium_executor = appium_executor or AppiumExecutor(driver)
+    trajectory = Trajectory.load(path)
+    print(f"[Replay]: Replaying {len(trajectory.steps)} recorded steps from {path}...")
+    result = replay_trajectory(trajectory, driver, appium_executor)
+    if result.completed:
+        print(f"[Replay]: Goal replayed in {result.seconds:.1f}s without Gemini.")
+        return result, 0
+
+    print(f"[Replay]: Diverged at step {result.diverged_at + 1} ({result.reason}); handing over to Gemini.")
+    recorder = TrajectoryRecorder(trajectory.goal, path, steps=trajectory.steps[:result.diverged_at],
+                                  patched_at_step=result.diverged_at)
+    outcome = run_goal(driver, trajectory.goal, appium_executor=appium_executor, recorder=recorder)
+    if outcome["status"] == "Goal_Achieved":
+        print(f"[Replay]: Recording patched from step {result.diverged_at + 1}.")
+    return result, outcome["model_calls"]
+
+
+def replay_suite(paths, device_capabilities=None):
+    """Replays trajectory files (or directories of them) through one warm session and reports the suite."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json")))
+        else:
+            files.append(path)
+
+    results = []
+    with SessionManager(device_capabilities or capabilities, create_driver) as session:
+        executor = None
+        for index, path in enumerate(files):
+            print(f"\n=== Trajectory {index + 1}/{len(files)}: {path} ===")
+            try:
+                driver = session.acquire(reset=index > 0)
+                if executor is None or executor.driver is not driver: # new or reconnected session
+                    executor = AppiumExecutor(driver)
+                results.append(replay_goal(driver, path, executor))
+            except Exception as e:
+                print(f"[Replay ERROR]: Could not replay {path}: {e}")
+            finally:
+                session.release()
+    print(replay_summary(results))
+    return results
+
+
+def load_goals(path):
+    """Reads goals from a JSON list of strings, or a text file with goals separated by '---' lines."""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".json"):
+        return json.loads(content)
+    return [goal.strip() for goal in re.split(r"^---\s*$", content, flags=re.MULTILINE) if goal.strip()]
 
 # --- How to run the Agentic Automation ---
 if __name__ == "__main__":
@@ -375,6 +1071,16 @@ if __name__ == "__main__":
         print("Please set it before running the script (e.g., export GOOGLE_API_KEY='your_api_key_here').")
         exit()
 
+    parser = argparse.ArgumentParser(description="Gemini-driven Appium automation agent.")
+    parser.add_argument("--goals-file", help="run the goals in this file (JSON list, or text separated by '---' lines) "
+                                             "through one warm session")
+    parser.add_argument("--replay", nargs="+", metavar="TRAJECTORY",
+                        help="replay recorded trajectory files (or directories of them) without Gemini")
+    parser.add_argument("--devices", help="comma-separated device udids to run the goals on in parallel")
+    args = parser.parse_args()
+    if TRACING_ENABLED:
+        tracing.configure(jsonl_path=TRACE_PATH)
+
     # --- Updated goal to include typing ---
     user_goal_scrolling = """
 Find 'Preference' in the main menu.
@@ -385,5 +1091,22 @@ On the 'Preference/9. Switch' screen:
 3.  Verify the 'Switch preference\\nThis is a switch with custom text'. If it is OFF, click it to turn it ON.
 Only declare GOAL_ACHIEVED after you have confirmed all three elements (Checkbox, Switch 1, Switch 2) are in their respective checked/ON states.
 """
-    print(f"Attempting to achieve goal: '{user_goal_scrolling}'")
-    run_agentic_automation_with_gemini(user_goal_scrolling)
\ No newline at end of file
+    if args.replay:
+        replay_suite(args.replay)
+    elif args.goals_file and not args.devices:
+        run_goals_in_session(load_goals(args.goals_file))
+    elif args.devices:
+        goals = load_goals(args.goals_file) if args.goals_file else [user_goal_scrolling]
+        udids = args.devices.split(",") if args.devices else [DEVICE_NAME]
+        # Parallel UiAutomator2 sessions need distinct systemPorts
+        device_capabilities_list = [capabilities_for_device(udid.strip(), system_port=8200 + i)
+                                    for i, udid in enumerate(udids)]
+        for result in run_goals_in_parallel(goals, device_capabilities_list):
+            print(f"   {result.status:24} {result.device or '-':16} {result.goal.strip().splitlines()[0][:60]}")
+    else:
+        print(f"Attempting to achieve goal: '{user_goal_scrolling}'")
+        run_agentic_automation_with_gemini(user_goal_scrolling)
+
+    if TRACING_ENABLED:
+        print(tracing.summary())
+        tracing.shutdown()
\ No newline at end of file
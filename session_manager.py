@@ -0,0 +1,157 @@
+"""
+Warm Appium sessions that outlive a single goal.
+
+Creating a UiAutomator2 session (server install/launch on the device, app start)
+takes several seconds, which dominates short goals. SessionManager keeps one
+session alive across goals:
+
+* acquire() returns a healthy driver, reconnecting transparently when the
+  session has gone stale (server restarted, newCommandTimeout expired, device
+  rebooted).
+* While the session is idle a background thread pings it often enough that
+  Appium's newCommandTimeout never fires.
+* reset_app() brings the app back to its launch state between goals with
+  terminate_app/activate_app, instead of reinstalling it or restarting the
+  session.
+
+Like DevicePool, it only talks to drivers through the callables it is given,
+so it runs against a fake driver.
+"""
+import threading
+import time
+
+from device_pool import default_health_check
+
+# Fallback when the capabilities don't set appium:newCommandTimeout (Appium's default, seconds)
+DEFAULT_NEW_COMMAND_TIMEOUT = 60
+# Ping this often relative to newCommandTimeout, so one missed ping doesn't lose the session
+KEEPALIVE_FRACTION = 1 / 3
+
+
+def reset_app(driver, app_package, app_activity=None):
+    """Restarts the app under test without touching the session. Returns seconds taken."""
+    start = time.perf_counter()
+    try:
+        driver.terminate_app(app_package)
+        driver.activate_app(app_package)
+    except Exception as e:
+        if not app_activity:
+            raise
+        # Older servers or drivers without app management: relaunch the activity directly
+        print(f"[Session WARNING]: terminate/activate failed ({e}); starting {app_activity} instead.")
+        driver.execute_script("mobile: startActivity", {
+            "component": f"{app_package}/{app_activity}", "stop": True})
+    return time.perf_counter() - start
+
+
+class SessionManager:
+    """Keeps one Appium session warm across goals, with keep-alive pings and transparent reconnects."""
+
+    def __init__(self, device_capabilities, driver_factory, health_check=default_health_check,
+                 keepalive_interval=None):
+        self.device_capabilities = device_capabilities
+        self.driver_factory = driver_factory
+        self.health_check = health_check
+        if keepalive_interval is None:
+            timeout = device_capabilities.get("appium:newCommandTimeout") or DEFAULT_NEW_COMMAND_TIMEOUT
+            keepalive_interval = timeout * KEEPALIVE_FRACTION
+        self.keepalive_interval = keepalive_interval
+        self.app_package = device_capabilities.get("appium:appPackage")
+        self.app_activity = device_capabilities.get("appium:appActivity")
+
+        self.driver = None
+        self.sessions_created = 0
+        self.session_seconds = 0.0  # total time spent creating sessions
+        self.last_startup_seconds = 0.0  # acquire() + reset_app() of the most recent goal
+        self._lock = threading.Lock()  # serializes keep-alive pings with acquire/release
+        self._in_use = False
+        self._last_used = time.monotonic()
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+
+    # --- Session lifecycle ---
+    def acquire(self, reset=False):
+        """Returns a healthy driver, reconnecting if needed; with reset=True the app is restarted too."""
+        start = time.perf_counter()
+        with self._lock:
+            self._in_use = True
+            try:
+                self._ensure_session()
+            except Exception:
+                self._in_use = False
+                raise
+        if reset and self.app_package:
+            try:
+                reset_app(self.driver, self.app_package, self.app_activity)
+            except Exception as e:
+                print(f"[Session WARNING]: Could not reset {self.app_package}: {e}")
+        self.last_startup_seconds = time.perf_counter() - start
+        self._start_keepalive()
+        return self.driver
+
+    def release(self):
+        """Marks the session idle so the keep-alive thread starts pinging it."""
+        with self._lock:
+            self._in_use = False
+            self._last_used = time.monotonic()
+
+    def close(self):
+        """Stops the keep-alive thread and quits the session."""
+        self._stop.set()
+        if self._keepalive_thread is not None:
+            self._keepalive_thread.join(timeout=5)
+            self._keepalive_thread = None
+        with self._lock:
+            self._quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _ensure_session(self):
+        if self.driver is not None:
+            try:
+                if self.health_check(self.driver):
+                    return
+            except Exception as e:
+                print(f"[Session]: Session went stale ({e}). Reconnecting.")
+            self._quit()
+        print("[Session]: Starting Appium session...")
+        start = time.perf_counter()
+        self.driver = self.driver_factory(self.device_capabilities)
+        elapsed = time.perf_counter() - start
+        self.sessions_created += 1
+        self.session_seconds += elapsed
+        print(f"[Session]: Session started in {elapsed:.1f}s.")
+
+    def _quit(self):
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+        except Exception as e:
+            print(f"[Session WARNING]: Error while quitting session: {e}")
+        self.driver = None
+
+    # --- Keep-alive ---
+    def _start_keepalive(self):
+        if not self.keepalive_interval or self._keepalive_thread is not None:
+            return
+        self._stop.clear()
+        self._keepalive_thread = threading.Thread(target=self._keepalive_loop, name="appium-keepalive", daemon=True)
+        self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(min(self.keepalive_interval, 5.0)):
+            with self._lock:
+                idle = time.monotonic() - self._last_used
+                if self._in_use or self.driver is None or idle < self.keepalive_interval:
+                    continue
+                try:
+                    self.health_check(self.driver)
+                except Exception as e:
+                    # Leave the reconnect to the next acquire()
+                    print(f"[Session WARNING]: Keep-alive ping failed: {e}")
+                self._last_used = time.monotonic()
@@ -0,0 +1,106 @@
+"""
+Checks the local XPath evaluator in element_index against lxml on the committed page_source dumps.
+
+Every expression must select exactly the nodes a real XPath 1.0 engine selects on the same XML
+(UiAutomator2 evaluates locators on the same attribute-only DOM), or be reported as unsupported.
+"""
+import glob
+import os
+import sys
+
+import pytest
+
+etree = pytest.importorskip("lxml.etree")
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from element_index import ElementIndex, XPathUnsupported, evaluate_xpath  # noqa: E402
+from ui_compaction import UiTree  # noqa: E402
+
+DUMPS = sorted(glob.glob(os.path.join(ROOT_DIR, "benchmarks", "dumps", "*.xml")))
+
+# Locator shapes Gemini and the compact tree produce, plus the corners of the supported subset
+EXPRESSIONS = [
+    "//*",
+    "/hierarchy/*",
+    "//android.widget.TextView",
+    "//android.widget.TextView[1]",
+    "(//android.widget.TextView)[1]",
+    "(//android.widget.TextView)[last()]",
+    "//android.widget.TextView[position() = 2]",
+    "//*[@text='Preference']",
+    "//*[@text=\"9. Switch\"]",
+    "//*[text()='Preference']",
+    "//android.widget.TextView[text()=\"Preference\"]",
+    "//*[contains(text(), 'Pref')]",
+    "//*[not(text())]",
+    "//*[normalize-space()='Preference']",
+    "//*[. = 'Preference']",
+    "//*[string-length() = 0][@clickable='true']",
+    "//*[contains(@text, 'Pref')]",
+    "//*[starts-with(@resource-id, 'android:id/')]",
+    "//*[@checkable='true' and @checked='false']",
+    "//*[@checked='true' or @selected='true']",
+    "//*[@content-desc != '']",
+    "//*[string-length(@text) > 0]",
+    "//*[@clickable='true'][.//*[@text='Preference']]",
+    "//android.widget.LinearLayout[@clickable=\"true\"][.//*[@text=\"This is a switch\"]]",
+    "//*[@text='Preference']/..",
+    "//*[@resource-id='android:id/checkbox']/../..",
+    "//android.widget.ListView/*[3]",
+    "//*[@resource-id='android:id/title'][2]",
+]
+
+
+def _reference_nodes(xml_bytes, expression):
+    """Document-order indexes (matching UiTree.nodes) of the elements lxml selects."""
+    root = etree.fromstring(xml_bytes)
+    elements = list(root.iter())
+    if root.tag == "hierarchy":
+        elements = elements[1:]
+    positions = {element: index for index, element in enumerate(elements)}
+    result = root.getroottree().xpath(expression)
+    return sorted(positions[element] for element in result if element in positions)
+
+
+def _local_nodes(tree, expression):
+    positions = {id(node): index for index, node in enumerate(tree.nodes)}
+    return sorted(positions[id(node)] for node in evaluate_xpath(tree, expression))
+
+
+def _expressions(tree):
+    """The fixed expressions plus the XPath locators the compact tree generates for every node."""
+    expressions = list(EXPRESSIONS)
+    for node in tree.nodes:
+        by, value = tree.locator_for(node)
+        if by == "XPATH":
+            expressions.append(value)
+        expressions.append(node.xpath)
+    return expressions
+
+
+@pytest.mark.parametrize("dump", DUMPS, ids=os.path.basename)
+def test_local_xpath_matches_lxml(dump):
+    with open(dump, "rb") as f:
+        xml_bytes = f.read()
+    tree = UiTree(xml_bytes.decode("utf-8"))
+    evaluated = 0
+    for expression in _expressions(tree):
+        try:
+            local = _local_nodes(tree, expression)
+        except XPathUnsupported:
+            continue
+        assert local == _reference_nodes(xml_bytes, expression), expression
+        evaluated += 1
+    assert evaluated >= len(EXPRESSIONS) - 3
+
+
+@pytest.mark.parametrize("dump", DUMPS, ids=os.path.basename)
+def test_text_function_matches_nothing(dump):
+    """UiAutomator2's DOM has no text nodes, so text() locators fail on the device and must fail locally."""
+    with open(dump, "rb") as f:
+        index = ElementIndex(f.read().decode("utf-8"))
+    label = next(node.text for node in index.tree.nodes if node.text)
+    assert index.resolve("XPATH", f"//*[text()='{label}']").status == "missing"
+    assert index.resolve("XPATH", f"//*[@text='{label}']").status in ("unique", "ambiguous")
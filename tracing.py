@@ -0,0 +1,248 @@
+"""
+Per-phase tracing for the Perceive-Plan-Act loop.
+
+Code wraps each phase in a span:
+
+    with tracing.span("model_call", request_bytes=n) as s:
+        response = convo.send_message(parts)
+        s.set(prompt_tokens=response.usage_metadata.prompt_token_count)
+
+Spans nest per thread (goal > turn > model_call ...); work handed to another thread
+passes current_span() along as the explicit parent. Every finished span goes to
+the configured sinks: JsonlSink writes one JSON line per span, SummarySink keeps
+p50/p95 latency per span name for the end-of-run summary, and any TraceSink
+subclass can forward spans to another metrics backend. Until configure() is
+called with at least one sink, span() returns a shared no-op span, so leaving
+the instrumentation in costs one function call per phase.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty sequence, e.g. fraction=0.95 for p95."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class TraceSink:
+    """Receives every finished span as a dict; subclass it to plug in a metrics backend."""
+
+    def emit(self, record):
+        raise NotImplementedError
+
+    def emit_summary(self, stats):
+        """Called once at shutdown with the per-phase stats ({name: {count, total_ms, p50_ms, p95_ms}})."""
+
+    def close(self):
+        pass
+
+
+class JsonlSink(TraceSink):
+    """Appends one JSON object per span to a file."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def emit_summary(self, stats):
+        self.emit({"summary": stats})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SummarySink(TraceSink):
+    """Aggregates span durations per name for a p50/p95 summary."""
+
+    def __init__(self):
+        self.durations = {}  # span name -> list of milliseconds
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        with self._lock:
+            self.durations.setdefault(record["name"], []).append(record["duration_ms"])
+
+    def stats(self):
+        with self._lock:
+            return {name: {"count": len(values), "total_ms": sum(values), "p50_ms": percentile(values, 0.5),
+                           "p95_ms": percentile(values, 0.95)}
+                    for name, values in self.durations.items()}
+
+    def summary(self):
+        stats = self.stats()
+        if not stats:
+            return "[Trace]: No spans recorded."
+        lines = [f"[Trace]: Latency per phase ({'count':>5} {'p50 ms':>9} {'p95 ms':>9} {'total s':>8}):"]
+        for name, s in sorted(stats.items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(f"   {name:18} {s['count']:5} {s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['total_ms'] / 1000:8.2f}")
+        return "\n".join(lines)
+
+
+class Span:
+    """A timed phase. Usable as a context manager, or started and finish()ed by hand."""
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.id = next(tracer._ids)
+        self.parent_id = parent.id if parent else None
+        self.trace_id = parent.trace_id if parent else self.id
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._finished = False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def finish(self, error=None):
+        if self._finished:
+            return
+        self._finished = True
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        self.tracer._pop(self)
+        record = {"name": self.name, "trace": self.trace_id, "id": self.id, "parent": self.parent_id,
+                  "start": round(self.start_time, 6), "duration_ms": round(duration_ms, 3),
+                  "thread": threading.current_thread().name}
+        if error is not None:
+            record["error"] = error
+        record.update(self.attributes)
+        self.tracer._emit(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(error=exc_type.__name__ if exc_type else None)
+
+
+class _NullSpan:
+    """Returned while tracing is disabled; every operation is a no-op."""
+
+    def set(self, **attributes):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, root=False, parent=None, **attributes):
+        """
+        Starts a span as a child of this thread's current span (root=True starts a new trace).
+        parent overrides that, for work running on a thread other than the one that started it.
+        """
+        if not self.sinks:
+            return NULL_SPAN
+        stack = self._stack()
+        if root:
+            del stack[:]  # drop spans an exception left unfinished
+        new_span = Span(self, name, parent or (stack[-1] if stack else None), attributes)
+        stack.append(new_span)
+        return new_span
+
+    def current_span(self):
+        """This thread's innermost open span, or None."""
+        stack = self._stack() if self.sinks else None
+        return stack[-1] if stack else None
+
+    def _pop(self, finished_span):
+        stack = self._stack()
+        if finished_span in stack:
+            del stack[stack.index(finished_span):]
+
+    def _emit(self, record):
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception as e:
+                print(f"[Trace WARNING]: Sink {type(sink).__name__} failed: {e}")
+
+    def summary(self):
+        summaries = [sink.summary() for sink in self.sinks if isinstance(sink, SummarySink)]
+        return "\n".join(summaries) if summaries else "[Trace]: Tracing is disabled."
+
+    def close(self):
+        stats = next((sink.stats() for sink in self.sinks if isinstance(sink, SummarySink)), None)
+        for sink in self.sinks:
+            if stats:
+                sink.emit_summary(stats)
+            sink.close()
+
+
+_tracer = Tracer()
+
+
+def configure(jsonl_path=None, sinks=(), summary=True):
+    """Enables tracing for the process: JSONL output, extra sinks and/or the p50/p95 summary."""
+    global _tracer
+    all_sinks = list(sinks)
+    if jsonl_path:
+        all_sinks.append(JsonlSink(jsonl_path))
+    if summary:
+        all_sinks.append(SummarySink())
+    _tracer.close()
+    _tracer = Tracer(all_sinks)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, root=False, parent=None, **attributes):
+    return _tracer.span(name, root=root, parent=parent, **attributes)
+
+
+def current_span():
+    return _tracer.current_span()
+
+
+def summary():
+    return _tracer.summary()
+
+
+def shutdown():
+    """Flushes and closes the sinks; tracing is disabled afterwards."""
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer()
@@ -0,0 +1,152 @@
+"""
+Trajectory recording and LLM-free replay.
+
+A successful goal is saved as a compact trajectory: the goal and, per executed
+step, the fingerprint of the screen it ran on, the resolved action (real
+locators, no handles or thoughts), its outcome and settle time. Replaying a
+trajectory re-executes the steps through AppiumExecutor without any model call,
+checking before every step that the screen fingerprint still matches the
+recording. At the first divergence (different screen, or a step that fails)
+the replay stops and reports where, so the caller can hand control back to
+GeminiAgent and patch the recording from that step on.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from ui_compaction import screen_fingerprint
+
+TRAJECTORY_VERSION = 1
+
+# Keys of an action that don't affect what gets executed
+_UNRECORDED_KEYS = ("thought", "handle")
+
+
+def trajectory_path(directory, goal_text):
+    """Stable file name for a goal: a slug of its first words plus a short hash of the whole text."""
+    normalized_goal = " ".join(goal_text.split())
+    slug = re.sub(r"[^a-z0-9]+", "-", normalized_goal.lower())[:40].strip("-") or "goal"
+    digest = hashlib.sha1(normalized_goal.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(directory, f"{slug}-{digest}.json")
+
+
+class Trajectory:
+    """A recorded goal: its steps and how the recording ended."""
+
+    def __init__(self, goal, steps=None, final_status=None, recorded_at=None, patched_at_step=None):
+        self.goal = goal
+        self.steps = list(steps or [])
+        self.final_status = final_status
+        self.recorded_at = recorded_at
+        self.patched_at_step = patched_at_step
+
+    def to_dict(self):
+        return {"version": TRAJECTORY_VERSION, "goal": self.goal, "final_status": self.final_status,
+                "recorded_at": self.recorded_at, "patched_at_step": self.patched_at_step, "steps": self.steps}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["goal"], data.get("steps"), data.get("final_status"), data.get("recorded_at"),
+                   data.get("patched_at_step"))
+
+    def save(self, path):
+        """Writes the trajectory atomically, so an interrupted run never leaves a truncated file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".trajectory.", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(), f, indent=1)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class TrajectoryRecorder:
+    """Collects the executed steps of one goal run; steps=... continues an earlier (replayed) prefix."""
+
+    def __init__(self, goal, path, steps=None, patched_at_step=None):
+        self.trajectory = Trajectory(goal, steps, patched_at_step=patched_at_step)
+        self.path = path
+
+    def record(self, fingerprint, action, outcome, settle_time=0.0):
+        """Records a step that succeeded (or a terminal GOAL_ACHIEVED); failed attempts are not replayable."""
+        if outcome not in ("success", "goal_achieved") or not fingerprint:
+            return
+        action = {k: v for k, v in action.items() if k not in _UNRECORDED_KEYS}
+        self.trajectory.steps.append({"fingerprint": fingerprint, "action": action, "outcome": outcome,
+                                      "settle_time": round(settle_time, 3)})
+
+    def finish(self, final_status):
+        """Saves the trajectory if the goal was achieved; returns whether it was saved."""
+        if final_status != "Goal_Achieved" or not self.path:
+            return False
+        self.trajectory.final_status = final_status
+        self.trajectory.recorded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.trajectory.save(self.path)
+        print(f"[Trajectory]: Saved {len(self.trajectory.steps)} steps to {self.path}.")
+        return True
+
+
+class ReplayResult:
+    """Outcome of replaying one trajectory up to its end or its first divergence."""
+
+    def __init__(self, trajectory, steps_replayed, diverged_at=None, reason="", seconds=0.0):
+        self.trajectory = trajectory
+        self.steps_replayed = steps_replayed
+        self.diverged_at = diverged_at  # index of the first step that could not be replayed, or None
+        self.reason = reason
+        self.seconds = seconds
+
+    @property
+    def completed(self):
+        return self.diverged_at is None
+
+
+def replay_trajectory(trajectory, driver, executor):
+    """
+    Re-executes a trajectory's steps without any model call, checking the screen fingerprint before each.
+    executor is an AppiumExecutor (or anything with update_element_index and execute_action).
+    """
+    start = time.perf_counter()
+    for index, step in enumerate(trajectory.steps):
+        ui_tree_xml = driver.page_source
+        fingerprint = screen_fingerprint(ui_tree_xml)
+        if fingerprint != step["fingerprint"]:
+            reason = f"screen {fingerprint} differs from the recorded {step['fingerprint']}"
+            return ReplayResult(trajectory, index, index, reason, time.perf_counter() - start)
+        action = step["action"]
+        if action.get("action") == "GOAL_ACHIEVED":
+            return ReplayResult(trajectory, index + 1, seconds=time.perf_counter() - start)
+        executor.update_element_index(ui_tree_xml)
+        result = executor.execute_action(action)
+        if result["status"] != "success":
+            reason = f"'{action.get('action')}' {result['status']}: {result.get('reason', '')}".rstrip(": ")
+            return ReplayResult(trajectory, index, index, reason, time.perf_counter() - start)
+    # Recordings always end in GOAL_ACHIEVED; a trajectory without it can't prove the goal is met
+    return ReplayResult(trajectory, len(trajectory.steps), len(trajectory.steps),
+                        "trajectory ended without GOAL_ACHIEVED", time.perf_counter() - start)
+
+
+def replay_summary(results):
+    """Per-suite replay throughput and divergence rate for a list of (ReplayResult, repair_model_calls)."""
+    if not results:
+        return "[Replay]: No trajectories were replayed."
+    steps = sum(result.steps_replayed for result, _ in results)
+    seconds = sum(result.seconds for result, _ in results)
+    diverged = [result for result, _ in results if not result.completed]
+    repair_calls = sum(calls for _, calls in results)
+    lines = [f"[Replay]: {len(results)} trajectories, {steps} steps replayed in {seconds:.1f}s "
+             f"({steps / seconds if seconds else 0:.1f} steps/s), "
+             f"{len(diverged)} diverged ({len(diverged) / len(results):.0%}), "
+             f"{repair_calls} Gemini calls spent repairing."]
+    for result in diverged:
+        lines.append(f"   diverged at step {result.diverged_at + 1}: {result.reason}  "
+                     f"({result.trajectory.goal.strip().splitlines()[0][:50]})")
+    return "\n".join(lines)
@@ -0,0 +1,402 @@
+"""
+UI-tree compaction for the Gemini prompt.
+
+UiAutomator2's page_source is mostly layout-only wrappers and default-valued
+attributes. This module parses the XML once and renders a compact, indented
+text form that keeps only visible nodes the agent can act on or read, with a
+short stable handle per node that maps back to a real Appium locator.
+"""
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+
+# Upper bound for the compacted tree in the prompt (bytes of UTF-8 text)
+DEFAULT_UI_TREE_BUDGET = 12000
+# Long text values are truncated to this many characters in the compact form
+DEFAULT_MAX_TEXT_CHARS = 80
+
+# Boolean attributes that make a node worth acting on
+INTERACTIVE_FLAGS = ("clickable", "long-clickable", "checkable", "scrollable")
+# Class name suffixes that accept text input even when not flagged clickable
+EDITABLE_CLASS_SUFFIXES = ("EditText", "AutoCompleteTextView", "SearchView")
+
+_BOUNDS_RE = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+# Text a Switch/ToggleButton reports for its state; it changes on every toggle, so it can't identify the node
+STATE_TEXTS = ("ON", "OFF")
+_CLASS_PREFIXES = ("android.widget.", "android.view.", "androidx.recyclerview.widget.", "android.webkit.")
+
+
+def parse_bounds(value):
+    """Parses a UiAutomator bounds string like '[0,63][1080,210]' into (x1, y1, x2, y2)."""
+    match = _BOUNDS_RE.match(value or "")
+    if not match:
+        return None
+    return tuple(int(v) for v in match.groups())
+
+
+def bounds_center(bounds):
+    """Returns the integer (x, y) center of a bounds tuple."""
+    x1, y1, x2, y2 = bounds
+    return (x1 + x2) // 2, (y1 + y2) // 2
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for payload reporting."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def xpath_literal(value):
+    """Quotes a string for use inside an XPath expression, even if it contains quotes."""
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    parts = value.split('"')
+    return "concat(" + ", '\"', ".join(f'"{part}"' for part in parts) + ")"
+
+
+# Volatile text (clocks, dates) that must not change a screen's fingerprint
+_VOLATILE_TEXT_PATTERNS = (
+    re.compile(r"\b\d{1,2}:\d{2}(:\d{2})?\s*([AaPp]\.?[Mm]\.?)?"),
+    re.compile(r"\b\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}\b"),
+)
+# Badge and unread counters, the only nodes whose plain numbers are masked as well
+_COUNTER_ID_RE = re.compile(r"badge|counter|unread", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"\d+")
+# Packages whose nodes (status bar, notifications) are never part of the app's screen
+_SYSTEM_PACKAGES = ("com.android.systemui",)
+
+
+def normalize_volatile_text(value, counter=False):
+    """
+    Masks clock times and dates (and, for a counter node, every number) so they don't change a
+    fingerprint. Other numbers stay: list pages and numbered menus are distinct screens.
+    """
+    for pattern in _VOLATILE_TEXT_PATTERNS:
+        value = pattern.sub("#", value)
+    return _NUMBER_RE.sub("#", value) if counter else value
+
+
+def screen_fingerprint(ui_tree):
+    """
+    Returns a short, stable hash of a screen's visible structure and state.
+    Accepts page_source XML or an already parsed UiTree. Bounds, focus and volatile
+    text are ignored; checked/enabled/selected state is part of the fingerprint.
+    """
+    tree = ui_tree if isinstance(ui_tree, UiTree) else UiTree(ui_tree)
+    digest = hashlib.sha1()
+    for node in tree.nodes:
+        if node.get("package") in _SYSTEM_PACKAGES or not node.is_visible(tree.screen):
+            continue
+        if not (node.is_interactive or node.is_informative or node.resource_id):
+            continue
+        state = "".join("1" if node.flag(name) else "0" for name in ("checked", "selected"))
+        state += "0" if node.get("enabled") == "false" else "1"
+        counter = bool(_COUNTER_ID_RE.search(node.resource_id))
+        digest.update("|".join((node.class_name, node.resource_id, normalize_volatile_text(node.content_desc, counter),
+                                normalize_volatile_text(node.text, counter), state)).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()[:16]
+
+
+class UiNode:
+    """A single element from page_source with the attributes the agent cares about."""
+
+    def __init__(self, element, parent, xpath):
+        self.element = element
+        self.parent = parent
+        self.xpath = xpath
+        self.children = []
+        self.class_name = element.get("class") or element.tag
+        self.resource_id = element.get("resource-id", "")
+        self.content_desc = element.get("content-desc", "")
+        self.text = element.get("text", "")
+        self.bounds = parse_bounds(element.get("bounds"))
+        self.handle = None
+
+    def flag(self, name):
+        return self.element.get(name) == "true"
+
+    def get(self, name, default=None):
+        return self.element.get(name, default)
+
+    @property
+    def short_class(self):
+        for prefix in _CLASS_PREFIXES:
+            if self.class_name.startswith(prefix):
+                return self.class_name[len(prefix):]
+        return self.class_name
+
+    @property
+    def identity_text(self):
+        """The node's text unless it only reflects a toggle's state."""
+        if self.get("checkable") == "true" and self.text.upper() in STATE_TEXTS:
+            return ""
+        return self.text
+
+    @property
+    def is_editable(self):
+        return self.class_name.endswith(EDITABLE_CLASS_SUFFIXES)
+
+    @property
+    def is_interactive(self):
+        return self.is_editable or any(self.flag(name) for name in INTERACTIVE_FLAGS)
+
+    @property
+    def is_informative(self):
+        return bool(self.text or self.content_desc)
+
+    def is_visible(self, screen):
+        if self.element.get("displayed") == "false":
+            return False
+        if self.bounds is None:
+            return True
+        x1, y1, x2, y2 = self.bounds
+        if x2 <= x1 or y2 <= y1:
+            return False
+        if screen:
+            sx1, sy1, sx2, sy2 = screen
+            if x2 <= sx1 or y2 <= sy1 or x1 >= sx2 or y1 >= sy2:
+                return False
+        return True
+
+
+class UiTree:
+    """Parsed page_source: every node in document order plus the top-level roots."""
+
+    def __init__(self, xml_text):
+        self.xml_text = xml_text
+        root = ET.fromstring(xml_text.encode("utf-8") if isinstance(xml_text, str) else xml_text)
+        self.nodes = []
+        self.roots = []
+        self.screen = None
+        if root.get("width") and root.get("height"):
+            self.screen = (0, 0, int(root.get("width")), int(root.get("height")))
+
+        if root.tag == "hierarchy":
+            self._add_children(root, None, "/hierarchy")
+        else:
+            self.roots.append(self._add_node(root, None, f"/{root.tag}"))
+
+        if self.screen is None and self.roots and self.roots[0].bounds:
+            self.screen = self.roots[0].bounds
+        self._assign_handles()
+
+    def _add_children(self, element, parent, path):
+        tag_counts = {}
+        for child in element:
+            tag_counts[child.tag] = tag_counts.get(child.tag, 0) + 1
+            node = self._add_node(child, parent, f"{path}/{child.tag}[{tag_counts[child.tag]}]")
+            if parent is None:
+                self.roots.append(node)
+            else:
+                parent.children.append(node)
+
+    def _add_node(self, element, parent, path):
+        node = UiNode(element, parent, path)
+        self.nodes.append(node)
+        self._add_children(element, node, path)
+        return node
+
+    def _assign_handles(self):
+        # Handles derive from identifying attributes (not position), so the same
+        # element keeps its handle across turns even when siblings come and go.
+        seen_keys = {}
+        used = set()
+        for node in self.nodes:
+            key = "|".join((node.class_name, node.resource_id, node.content_desc, node.identity_text))
+            occurrence = seen_keys.get(key, 0)
+            seen_keys[key] = occurrence + 1
+            digest = hashlib.sha1(f"{key}|{occurrence}".encode("utf-8")).hexdigest()
+            handle = "e" + digest[:4]
+            if handle in used:
+                handle = "e" + digest[:6]
+            suffix = 1
+            while handle in used:
+                handle = f"e{digest[:6]}{suffix}"
+                suffix += 1
+            used.add(handle)
+            node.handle = handle
+
+    def locator_for(self, node):
+        """Returns the most robust (by, value) locator that uniquely identifies node."""
+        if node.resource_id and self._count(lambda n: n.resource_id == node.resource_id) == 1:
+            return "ID", node.resource_id
+        if node.content_desc and self._count(lambda n: n.content_desc == node.content_desc) == 1:
+            return "ACCESSIBILITY_ID", node.content_desc
+        if node.identity_text and self._count(lambda n: n.class_name == node.class_name and n.text == node.text) == 1:
+            return "XPATH", f"//{node.class_name}[@text={xpath_literal(node.text)}]"
+        anchored = self._anchored_xpath(node)
+        if anchored:
+            return "XPATH", anchored
+        return "XPATH", node.xpath
+
+    def _anchored_xpath(self, node):
+        """Locates a label-less container (e.g. a list row) by a unique text inside it."""
+        clickable = node.flag("clickable")
+        similar = [n for n in self.nodes if n.class_name == node.class_name and n.flag("clickable") == clickable]
+        for descendant in iter_descendants(node):
+            if not descendant.identity_text or self._count(lambda n: n.text == descendant.text) != 1:
+                continue
+            owners = [n for n in similar if descendant in iter_descendants(n)]
+            if owners == [node]:
+                clickable_filter = '[@clickable="true"]' if clickable else ""
+                return f"//{node.class_name}{clickable_filter}[.//*[@text={xpath_literal(descendant.text)}]]"
+        return None
+
+    def _count(self, predicate):
+        return sum(1 for n in self.nodes if predicate(n))
+
+
+def iter_descendants(node):
+    """Yields every node below node, depth first."""
+    for child in node.children:
+        yield child
+        yield from iter_descendants(child)
+
+
+class CompactTree:
+    """Result of compaction: the prompt text plus the handle -> node mapping."""
+
+    def __init__(self, tree, text, kept_count):
+        self.tree = tree
+        self.text = text
+        self.kept_count = kept_count
+        self.handles = {node.handle: node for node in tree.nodes}
+        self.original_bytes = len(tree.xml_text.encode("utf-8")) if isinstance(tree.xml_text, str) else len(tree.xml_text)
+        self.compact_bytes = len(text.encode("utf-8"))
+
+    def locator_for_handle(self, handle):
+        """Maps a handle from the compact tree back to an Appium (by, value) locator."""
+        node = self.handles.get(handle)
+        if node is None:
+            return None
+        return self.tree.locator_for(node)
+
+    @property
+    def reduction(self):
+        if not self.original_bytes:
+            return 0.0
+        return 1 - self.compact_bytes / self.original_bytes
+
+
+def _collect(node, screen):
+    """Returns the kept entries for node's subtree as (node, labels, children) tuples."""
+    if not node.is_visible(screen):
+        return []
+    kept_children = []
+    for child in node.children:
+        kept_children.extend(_collect(child, screen))
+
+    if node.is_interactive and not node.flag("scrollable"):
+        # Fold passive text (titles, summaries) into the actionable row that owns it
+        labels = []
+        children = []
+        for entry in kept_children:
+            texts = _passive_texts(entry)
+            if texts is None:
+                children.append(entry)
+            else:
+                labels.extend(texts)
+        return [(node, labels, children)]
+    if node.is_interactive:
+        return [(node, [], kept_children)]
+    if node.is_informative:
+        return [(node, [], kept_children)]
+    if len(kept_children) >= 2:
+        return [(node, [], kept_children)]
+    # Single-child wrapper chains collapse onto their only kept descendant
+    return kept_children
+
+
+def _passive_texts(entry):
+    """Returns the texts of a kept subtree with no interactive nodes, or None if it has any."""
+    node, labels, children = entry
+    if node.is_interactive:
+        return None
+    texts = [node.text or node.content_desc] if node.is_informative else []
+    texts.extend(labels)
+    for child in children:
+        child_texts = _passive_texts(child)
+        if child_texts is None:
+            return None
+        texts.extend(child_texts)
+    return texts
+
+
+def _truncate(value, limit):
+    value = value.replace("\n", " ")
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def _render_line(node, labels, depth, max_text_chars, include_bounds):
+    parts = [node.handle, node.short_class]
+    if node.text:
+        parts.append(f'"{_truncate(node.text, max_text_chars)}"')
+    if node.content_desc and node.content_desc != node.text:
+        parts.append(f'desc="{_truncate(node.content_desc, max_text_chars)}"')
+    if labels:
+        parts.append(f'label="{_truncate(" | ".join(labels), max_text_chars)}"')
+    if node.resource_id:
+        parts.append("#" + node.resource_id.split("/", 1)[-1])
+
+    flags = []
+    if node.flag("clickable"):
+        flags.append("click")
+    if node.flag("long-clickable"):
+        flags.append("longclick")
+    if node.flag("scrollable"):
+        flags.append("scroll")
+    if node.is_editable:
+        flags.append("edit")
+    if node.flag("checkable"):
+        flags.append("checked" if node.flag("checked") else "unchecked")
+    if node.get("enabled") == "false":
+        flags.append("disabled")
+    for name in ("selected", "focused", "password"):
+        if node.flag(name):
+            flags.append(name)
+    if flags:
+        parts.append("[" + ",".join(flags) + "]")
+    if include_bounds and node.bounds:
+        parts.append("@[{},{}][{},{}]".format(*node.bounds))
+    return "  " * depth + " ".join(parts)
+
+
+def _render(entries, depth, max_text_chars, include_bounds, lines):
+    for node, labels, children in entries:
+        if node.is_interactive or node.is_informative:
+            lines.append(_render_line(node, labels, depth, max_text_chars, include_bounds))
+        else:
+            lines.append("  " * depth + node.short_class)
+        _render(children, depth + 1, max_text_chars, include_bounds, lines)
+
+
+def compact_ui_tree(xml_text, max_bytes=DEFAULT_UI_TREE_BUDGET, max_text_chars=DEFAULT_MAX_TEXT_CHARS,
+                    include_bounds=False):
+    """
+    Parses page_source XML and returns a CompactTree whose text fits within max_bytes.
+    Raises xml.etree.ElementTree.ParseError if the XML cannot be parsed.
+    """
+    tree = UiTree(xml_text)
+    entries = []
+    for root in tree.roots:
+        entries.extend(_collect(root, tree.screen))
+
+    # Try progressively shorter text values before resorting to dropping lines
+    for text_limit in (max_text_chars, min(max_text_chars, 32)):
+        lines = []
+        _render(entries, 0, text_limit, include_bounds, lines)
+        text = "\n".join(lines)
+        if not max_bytes or len(text.encode("utf-8")) <= max_bytes:
+            return CompactTree(tree, text, len(lines))
+
+    kept = []
+    size = 0
+    for line in lines:
+        size += len(line.encode("utf-8")) + 1
+        if size > max_bytes - 64:
+            break
+        kept.append(line)
+    kept.append(f"... [{len(lines) - len(kept)} more nodes omitted to fit the UI tree budget]")
+    return CompactTree(tree, "\n".join(kept), len(kept) - 1)
@@ -0,0 +1,112 @@
+"""
+Adaptive UI-settle detection for AppiumExecutor.
+
+Replaces a fixed sleep after every action with polling: the screen is considered
+settled once a cheap hash of page_source stops changing for `stable_polls`
+consecutive polls, bounded by a per-action-type timeout budget. UiAutomator2
+already waits for the app to go idle before serving page_source, so each poll
+also benefits from its idle detection. Actions that don't touch the UI (terminal
+signals, errors, failed element lookups) skip waiting entirely.
+"""
+import hashlib
+import json
+import time
+
+from tracing import percentile
+
+# Maximum seconds to wait for the screen to settle, per action type
+DEFAULT_SETTLE_BUDGETS = {
+    "click": 5.0,
+    "type": 4.0,
+    "scroll": 3.0,
+    "press_keycode": 4.0,
+    "launch_app": 10.0,
+    "terminate_app": 3.0,
+}
+DEFAULT_POLL_INTERVAL = 0.2
+DEFAULT_STABLE_POLLS = 2
+# Upper bound (ms) for UiAutomator2's own wait-for-idle before each page_source
+DEFAULT_IDLE_TIMEOUT_MS = 1000
+
+
+class UiSettleWaiter:
+    """Waits until the UI stops changing after an action and records how long that took."""
+
+    def __init__(self, driver, budgets=None, poll_interval=DEFAULT_POLL_INTERVAL, stable_polls=DEFAULT_STABLE_POLLS,
+                 idle_timeout_ms=DEFAULT_IDLE_TIMEOUT_MS, log_path=None):
+        self.driver = driver
+        self.budgets = dict(DEFAULT_SETTLE_BUDGETS, **(budgets or {}))
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self.log_path = log_path
+        self.samples = []  # one dict per wait: action, seconds, timed_out, polls
+        self.last_page_source = None  # page_source of the latest poll, reusable once the screen has settled
+        if idle_timeout_ms is not None:
+            try:
+                self.driver.update_settings({"waitForIdleTimeout": idle_timeout_ms})
+            except Exception as e:
+                print(f"[Settle WARNING]: Could not set waitForIdleTimeout: {e}")
+
+    def _ui_hash(self):
+        self.last_page_source = self.driver.page_source
+        return hashlib.sha1(self.last_page_source.encode("utf-8")).digest()
+
+    def wait(self, action_type, status="success"):
+        """Blocks until the screen is stable or the action's budget runs out; returns seconds waited."""
+        budget = self.budgets.get(action_type)
+        self.last_page_source = None
+        if budget is None or status != "success":
+            return 0.0
+
+        start = time.perf_counter()
+        deadline = start + budget
+        polls = 0
+        stable = 0
+        timed_out = True
+        previous = None
+        while time.perf_counter() < deadline:
+            try:
+                current = self._ui_hash()
+            except Exception as e:
+                # A transient error mid-transition just means "not settled yet"
+                print(f"[Settle WARNING]: page_source poll failed: {e}")
+                self.last_page_source = None
+                current = None
+            polls += 1
+            if current is not None and current == previous:
+                stable += 1
+                if stable >= self.stable_polls - 1:
+                    timed_out = False
+                    break
+            else:
+                stable = 0
+            previous = current
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.perf_counter())))
+
+        elapsed = time.perf_counter() - start
+        self._record(action_type, elapsed, timed_out, polls)
+        return elapsed
+
+    def _record(self, action_type, seconds, timed_out, polls):
+        sample = {"action": action_type, "seconds": round(seconds, 3), "timed_out": timed_out, "polls": polls}
+        self.samples.append(sample)
+        note = " (budget exhausted)" if timed_out else ""
+        print(f"   -> UI settled in {seconds:.2f}s after {polls} polls{note}.")
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(sample) + "\n")
+
+    def summary(self):
+        """Per-action-type settle statistics, for tuning the budgets."""
+        if not self.samples:
+            return "[Settle]: No settle waits recorded."
+        lines = ["[Settle]: Settle times by action type (s):"]
+        for action_type in sorted({s["action"] for s in self.samples}):
+            times = [s["seconds"] for s in self.samples if s["action"] == action_type]
+            timeouts = sum(1 for s in self.samples if s["action"] == action_type and s["timed_out"])
+            lines.append(f"   {action_type:14} n={len(times):<3} p50={percentile(times, 0.5):.2f} "
+                         f"p95={percentile(times, 0.95):.2f} max={max(times):.2f} "
+                         f"timeouts={timeouts} budget={self.budgets[action_type]:.1f}")
+        total = sum(s["seconds"] for s in self.samples)
+        lines.append(f"   total settle time {total:.1f}s over {len(self.samples)} actions")
+        return "\n".join(lines)